@@ -1,16 +1,32 @@
+import asyncio
+import cca_core
+import csv
+import hashlib
 import json
 import logging
+import numpy as np
+import queue
+import re
 import requests
+import requests.adapters
 import pathlib
-import time
-import tldextract
+import threading
+import unicodedata
 
-from src.utils.utils import get_config, update_config, parse_metadata
+from src.utils.utils import get_config, update_config, parse_metadata, clean_emojis, DomainNormalizer
 from src.utils.db_manager import DBManager
 from cca_core.sentiment_analysis import SentimentAnalyzer
 
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from math import ceil
+from multiprocessing import Pool
+from pymongo import UpdateOne, UpdateMany
+from scipy import sparse
+from urllib.parse import urlsplit
 
 
 logging.basicConfig(filename=str(pathlib.Path(__file__).parents[1].joinpath('politic_bots.log')), level=logging.DEBUG)
@@ -22,11 +38,32 @@ class SentimentAnalysis:
     language = ''
     method = ''
     __db = None
+    __analyzer = None
+    __remote_client = None
+    __lexicon_analyzer = None
+    BATCH_SIZE = 100
+    RESUME_TOKEN = 'sentiment_analysis'
+    SENTIMENT_PROJECTION = {'tweet_obj.id_str': 1, 'tweet_obj.text': 1, 'tweet_obj.full_text': 1}
+    NON_ORIGINAL_PROJECTION = {'tweet_obj.id_str': 1, 'tweet_obj.text': 1, 'tweet_obj.full_text': 1,
+                               'tweet_obj.in_reply_to_status_id_str': 1, 'tweet_obj.retweeted_status.id_str': 1,
+                               'tweet_obj.retweeted_status.text': 1, 'tweet_obj.retweeted_status.full_text': 1}
+    PROPAGATION_BATCH_SIZE = 1000
+    REMOTE_PARAMETERS = {'neu_inf_lim': -0.3, 'neu_sup_lim': 0.3}
+    url_pattern = re.compile(r'https?://\S+')
 
-    def __init__(self, collection='tweets', language='spanish'):
+    def __init__(self, collection='tweets', language='spanish', use_cache=True, method='local'):
         self.config = get_config(self.config_file_name)
         self.language = language
+        self.method = method
         self.__dbm = DBManager(collection)
+        self.use_cache = use_cache
+        self.__dbm_cache = DBManager('sentiment_cache')
+        self.__cache_lookups, self.__cache_hits = 0, 0
+        # the versions are part of the keys of the cache, so results
+        # of different analyzers or settings are not mixed up
+        self.local_version = 'cca_core-{0}-{1}'.format(getattr(cca_core, '__version__', ''), language)
+        self.remote_version = 'inhouse-{0}-{1}-{2}'.format(language, self.REMOTE_PARAMETERS['neu_inf_lim'],
+                                                           self.REMOTE_PARAMETERS['neu_sup_lim'])
 
     def __get_analyzed_tweet(self, analyzed_tweets, id_tweet_to_search):
         for analyzed_tweet in analyzed_tweets:
@@ -34,6 +71,16 @@ class SentimentAnalysis:
                 return analyzed_tweet
         return None
 
+    def __get_sentiment_of_original_tweets(self):
+        # map id of original tweet -> sentiment built from a single projected scan
+        original_sentiments = {}
+        query = {'tweet_obj.retweeted_status': {'$exists': 0}}
+        projection = {'tweet_obj.id_str': 1, 'sentimiento': 1}
+        for tweet_regs in self.__dbm.iterate_by_id(query, self.PROPAGATION_BATCH_SIZE, projection):
+            for tweet_reg in tweet_regs:
+                original_sentiments[tweet_reg['tweet_obj']['id_str']] = tweet_reg.get('sentimiento')
+        return original_sentiments
+
     def update_sentiment_of_non_original_tweets(self, query={}, update_sentiment=False):
         if update_sentiment:
             query.update({
@@ -44,33 +91,38 @@ class SentimentAnalysis:
                 'relevante': 1,
                 'sentimiento': {'$exists': 0}
             })
-        tweet_regs = self.__dbm.search(query)
+        self.__dbm.create_index('tweet_obj.id_str')
+        original_sentiments = self.__get_sentiment_of_original_tweets()
         rts_wo_tw = []
-        for tweet_reg in tweet_regs:
-            if 'retweeted_status' in tweet_reg['tweet_obj'].keys():
-                id_original_tweet = tweet_reg['tweet_obj']['retweeted_status']['id_str']
-                original_tweet_reg = self.__dbm.find_record({'tweet_obj.id_str': id_original_tweet})
-                if original_tweet_reg:
-                    sentiment_ot = original_tweet_reg['sentimiento']
-                    if sentiment_ot:
-                        self.__dbm.update_record({'tweet_obj.id_str': tweet_reg['tweet_obj']['id_str']},
-                                                 {'sentimiento': sentiment_ot})
+        for tweet_regs in self.__dbm.iterate_by_id(query, self.PROPAGATION_BATCH_SIZE, self.NON_ORIGINAL_PROJECTION):
+            # ids of the rts grouped by their original tweet
+            rts_by_original = defaultdict(list)
+            for tweet_reg in tweet_regs:
+                if 'retweeted_status' in tweet_reg['tweet_obj'].keys():
+                    id_original_tweet = tweet_reg['tweet_obj']['retweeted_status']['id_str']
+                    if id_original_tweet in original_sentiments:
+                        if original_sentiments[id_original_tweet]:
+                            rts_by_original[id_original_tweet].append(tweet_reg['tweet_obj']['id_str'])
+                        else:
+                            raise Exception('Error, found an original tweet without sentiment')
                     else:
-                        raise Exception('Error, found an original tweet without sentiment')
-                else:
+                        rts_wo_tw.append(tweet_reg['tweet_obj'])
+                elif tweet_reg['tweet_obj'].get('in_reply_to_status_id_str'):
                     rts_wo_tw.append(tweet_reg['tweet_obj'])
-            elif tweet_reg['tweet_obj']['in_reply_to_status_id_str']:
-                rts_wo_tw.append(tweet_reg['tweet_obj'])
-                logging.info('Tweet not RT {0}'.format(tweet_reg['tweet_obj']['id_str']))
+                    logging.info('Tweet not RT {0}'.format(tweet_reg['tweet_obj']['id_str']))
+            self.__dbm.bulk_write([UpdateMany({'tweet_obj.id_str': {'$in': id_rts}},
+                                              {'$set': {'sentimiento': original_sentiments[id_original_tweet]}})
+                                   for id_original_tweet, id_rts in rts_by_original.items()])
         self.__analyze_sentiment_of_rt_wo_tws(rts_wo_tw)
 
     def __update_sentimient_rts(self, analyzed_tweets):
-        for analyzed_tweet in analyzed_tweets:
-            # search rts of the analyzed tweet
-            rts = self.__dbm.search({'tweet_obj.retweeted_status.id_str': analyzed_tweet['id']})
-            for rt in rts:
-                self.__dbm.update_record({'tweet_obj.id_str': rt['tweet_obj']['id_str']},
-                                         {'sentimiento': analyzed_tweet['sentimiento']})
+        # a single update of all the rts of every analyzed tweet
+        self.__dbm.create_index('tweet_obj.retweeted_status.id_str')
+        updates = [UpdateMany({'tweet_obj.retweeted_status.id_str': analyzed_tweet['id'], 'relevante': 1},
+                              {'$set': {'sentimiento': analyzed_tweet['sentimiento']}})
+                   for analyzed_tweet in analyzed_tweets]
+        for i in range(0, len(updates), self.PROPAGATION_BATCH_SIZE):
+            self.__dbm.bulk_write(updates[i:i+self.PROPAGATION_BATCH_SIZE])
 
     def __analyze_sentiment_of_rt_wo_tws(self, tweets):
         tot_tws = len(tweets)
@@ -101,9 +153,145 @@ class SentimentAnalysis:
                                                                                sentiment_info['tono'],
                                                                                sentiment_info['score']))
 
-    def analyze_sentiments(self, query={}, update_sentiment=False):
+    def __get_cache_key(self, text, analyzer_version):
+        # emojis and urls are removed and whitespaces collapsed so copies
+        # of the same text share the key
+        normalized_text = ' '.join(self.url_pattern.sub(' ', clean_emojis(text)).split())
+        key = '{0}\n{1}'.format(analyzer_version, normalized_text)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def __lookup_cache(self, tweets, analyzer_version):
+        """
+        Look up the sentiment of the tweets in the cache
+
+        :param tweets: list of dictionaries {'id', 'text'}
+        :param analyzer_version: identifier of the analyzer whose results are looked up
+        :return: tuple with the keys of the tweets, a dictionary key -> sentiment with the
+        cached results, and the list of tweets that have to be analyzed (one per key)
+        """
+        keys = [self.__get_cache_key(tweet['text'], analyzer_version) for tweet in tweets]
+        cached = {}
+        if self.use_cache and keys:
+            for cache_reg in self.__dbm_cache.search({'_id': {'$in': list(set(keys))}}):
+                cached[cache_reg['_id']] = cache_reg['sentimiento']
+        tweets_to_analyze, keys_to_analyze = [], set()
+        for tweet, key in zip(tweets, keys):
+            if key not in cached and key not in keys_to_analyze:
+                keys_to_analyze.add(key)
+                tweets_to_analyze.append(tweet)
+        self.__cache_lookups += len(tweets)
+        self.__cache_hits += len(tweets) - len(tweets_to_analyze)
+        return keys, cached, tweets_to_analyze
+
+    def __merge_results(self, tweets, keys, cached, results):
+        """
+        Combine the cached results with those just computed, which are stored in the cache
+
+        :return: list of sentiment results of the tweets, same structure of __process_results
+        """
+        id_keys = {tweet['id']: key for tweet, key in zip(tweets, keys)}
+        computed = {}
+        for result in results:
+            if result['id'] in id_keys:
+                computed[id_keys[result['id']]] = result['sentimiento']
+        if self.use_cache and computed:
+            self.__dbm_cache.bulk_write([UpdateOne({'_id': key}, {'$set': {'sentimiento': sentiment}}, upsert=True)
+                                         for key, sentiment in computed.items()])
+        ret = []
+        for tweet, key in zip(tweets, keys):
+            sentiment = cached.get(key, computed.get(key))
+            if sentiment:
+                ret.append({'id': tweet['id'], 'text': tweet['text'].strip(), 'sentimiento': sentiment})
+        logging.info('Sentiment cache hit rate {0:.1%} ({1} out of {2} tweets)'.format(self.get_cache_hit_rate(),
+                                                                                         self.__cache_hits,
+                                                                                         self.__cache_lookups))
+        return ret
+
+    def get_cache_hit_rate(self):
+        if self.__cache_lookups:
+            return self.__cache_hits / self.__cache_lookups
+        return 0.0
+
+    def __analyze_with_cache(self, tweets, analyze, analyzer_version):
+        keys, cached, tweets_to_analyze = self.__lookup_cache(tweets, analyzer_version)
+        results = analyze(tweets_to_analyze) if tweets_to_analyze else []
+        return self.__merge_results(tweets, keys, cached, results)
+
+    def __get_resume_name(self, query):
+        # every query has its own token, so an interrupted analysis is only resumed by one with the same query
+        query_key = json.dumps(query, sort_keys=True, default=str)
+        return '{0}.{1}'.format(self.RESUME_TOKEN, hashlib.sha1(query_key.encode('utf-8')).hexdigest()[:12])
+
+    def __get_tweets_to_analyze(self, query, batch_size, resume_name, processed_ids):
+        """
+        Stream the tweets that match the query in batches of fixed size, only the
+        id and text of the tweets are fetched from the db
+
+        :param query: dictionary with the filter of the tweets
+        :param batch_size: number of tweets per batch
+        :param resume_name: name of the resume token, tweets are read after the _id it holds
+        :param processed_ids: deque where the _id of the last record of every batch is appended
+        :return: generator of lists of dictionaries {'id', 'text'}
+        """
+        # batches are read ahead of their analysis, so the token is saved by the caller
+        for tweet_regs in self.__dbm.iterate_by_id(query, batch_size, self.SENTIMENT_PROJECTION,
+                                                   resume_name=resume_name, save_resume=False):
+            tweets_to_analyze = []
+            for tweet_reg in tweet_regs:
+                tweet = tweet_reg['tweet_obj']
+                if 'full_text' in tweet.keys():
+                    tweet_text = tweet['full_text']
+                else:
+                    tweet_text = tweet['text']
+                tweets_to_analyze.append({'id': tweet['id_str'], 'text': tweet_text})
+            processed_ids.append(tweet_regs[-1]['_id'])
+            yield tweets_to_analyze
+
+    def __analyze_batches(self, batches, workers):
+        """
+        Compute the sentiment of batches of tweets. With more than one worker, the
+        batches are fed to a pool of long-lived processes, each of which keeps its
+        own analyzer loaded, and results are yielded as soon as they are ready so that
+        they can be stored while the rest of batches are being analyzed. With the
+        remote method, several jobs are kept in flight in the api instead, and with
+        the lexicon method batches are scored right away in the main process
+
+        :param batches: iterable of lists of dictionaries {'id', 'text'}
+        :param workers: number of worker processes
+        :return: generator of lists of sentiment results
+        """
+        lookups = deque()
+
+        def get_texts_batches(analyzer_version):
+            for batch in batches:
+                keys, cached, tweets_to_analyze = self.__lookup_cache(batch, analyzer_version)
+                lookups.append((batch, keys, cached))
+                yield self.__get_tweet_texts(tweets_to_analyze)
+
+        if self.method == 'lexicon':
+            # scoring is cheaper than looking up the cache
+            for batch in batches:
+                yield self.lexicon_sentiment_analysis(batch)
+        elif self.method == 'remote':
+            # results are returned in the order of the batches, so the
+            # progress of the analysis can be safely saved after each one
+            for results in self.__get_remote_client().analyze_batches(get_texts_batches(self.remote_version)):
+                batch, keys, cached = lookups.popleft()
+                yield self.__merge_results(batch, keys, cached, self.__process_results(results))
+        elif workers <= 1:
+            for batch in batches:
+                yield self.do_sentiment_analysis(batch)
+        else:
+            with Pool(workers, initializer=_init_sentiment_worker, initargs=(self.language,)) as pool:
+                for results in pool.imap(_analyze_docs, get_texts_batches(self.local_version)):
+                    batch, keys, cached = lookups.popleft()
+                    yield self.__merge_results(batch, keys, cached, self.__process_results(results))
+
+    def analyze_sentiments(self, query={}, update_sentiment=False, workers=1):
         """
         :param query: dictionary of <key, value> terms to be used in querying the db
+        :param update_sentiment: whether to recompute the sentiment of tweets that already have it
+        :param workers: number of worker processes used to compute the sentiment
         """
         if update_sentiment:
             query.update({
@@ -116,35 +304,24 @@ class SentimentAnalysis:
                 'tweet_obj.retweeted_status': {'$exists': 0},
                 'sentimiento': {'$exists': 0}
             })
-        tweet_regs = self.__dbm.search(query)
         analyzed_tweets = []
-        tot_reg = tweet_regs.count()
-        logging.info('Going to analyze the sentiment of {0} tweets, '
-                     'it can take a lot of time, be patient...'.format(tot_reg))
-        batch_size = 100
-        total_batches = ceil(tot_reg/batch_size)
+        tot_reg = self.__dbm.search(query).count()
+        logging.info('Going to analyze the sentiment of {0} tweets using {1} worker(s), '
+                     'it can take a lot of time, be patient...'.format(tot_reg, workers))
+        total_batches = ceil(tot_reg/self.BATCH_SIZE)
         batch = 0
-        tweets_to_analyze = []
+        # the _id of the last tweet whose sentiment was stored is saved after every
+        # batch, so an interrupted analysis is resumed after it
+        resume_name = self.__get_resume_name(query)
+        processed_ids = deque()
+        finished = False
         try:
-            for current_reg in range(tot_reg):
-                tweet_reg = tweet_regs[current_reg]
-                tweet = tweet_reg['tweet_obj']
-                if 'full_text' in tweet.keys():
-                    tweet_text = tweet['full_text']
-                else:
-                    tweet_text = tweet['text']
-                if len(tweets_to_analyze) < batch_size and current_reg < tot_reg:
-                    tweets_to_analyze.append({'id': tweet['id_str'], 'text': tweet_text})
-                    if len(tweets_to_analyze) < batch_size:
-                        continue
+            batches = self.__get_tweets_to_analyze(query, self.BATCH_SIZE, resume_name, processed_ids)
+            for sentiment_results in self.__analyze_batches(batches, workers):
                 batch += 1
-                logging.info('Analyzing the sentiment of {0} tweets in batch {1}/{2} '
-                             'out of {3} tweets...'.format(len(tweets_to_analyze),batch, total_batches, tot_reg))
-                sentiment_results = self.do_sentiment_analysis(tweets_to_analyze)
                 logging.info('Finished analyzing the sentiment of {0} tweets in batch {1}/{2} '
-                             'out of {3} tweets...'.format(len(tweets_to_analyze),batch, total_batches, tot_reg))
+                             'out of {3} tweets...'.format(len(sentiment_results), batch, total_batches, tot_reg))
                 logging.info('Updating sentiment scores in database...')
-                tweets_to_analyze = []
                 for sentiment_result in sentiment_results:
                     sentiment_info = sentiment_result['sentimiento']
                     tweet_id = sentiment_result['id']
@@ -158,20 +335,31 @@ class SentimentAnalysis:
                     logging.debug('Tweet text: {0}, Sentimiento: {1} ({2})'.format(tweet_text.encode('utf-8'),
                                                                                    sentiment_info['tono'],
                                                                                    sentiment_info['score']))
+                self.__dbm.save_resume_token(resume_name, processed_ids.popleft())
+            finished = True
         except Exception as e:
             logging.error(e)
         finally:
             self.__update_sentimient_rts(analyzed_tweets)
+        if finished:
+            self.__dbm.clear_resume_token(resume_name)
+        if self.use_cache:
+            logging.info('The sentiment of {0:.1%} of the tweets was found in the cache'.format(self.get_cache_hit_rate()))
 
         return analyzed_tweets
 
+    def __get_tweet_texts(self, tweets):
+        return [tweet['text'] + ' -$%#$&- {0}'.format(tweet['id']) for tweet in tweets]
+
     def do_sentiment_analysis(self, tweets):
-        sa = SentimentAnalyzer(language='spanish')
-        tweet_texts = []
-        for tweet in tweets:
-            tweet_texts.append(tweet['text'] + ' -$%#$&- {0}'.format(tweet['id']))
-        sa.analyze_docs(tweet_texts)
-        results = sa.tagged_docs
+        return self.__analyze_with_cache(tweets, self.__do_sentiment_analysis, self.local_version)
+
+    def __do_sentiment_analysis(self, tweets):
+        # the analyzer is loaded once and reused for every batch
+        if self.__analyzer is None:
+            self.__analyzer = SentimentAnalyzer(language=self.language)
+        tweet_texts = self.__get_tweet_texts(tweets)
+        results = _run_analyzer(self.__analyzer, tweet_texts)
         logging.info('Finished the sentiment analysis, now {0} results are going to '
                      'be processed...'.format(len(results)))
         ret = self.__process_results(results)
@@ -179,57 +367,29 @@ class SentimentAnalysis:
         return ret
 
     def remote_sentiment_analysis(self, tweets):
-        accepted_codes = [200, 201, 202]
-        error_codes = [400, 401]
-        url_base = 'http://159.203.77.35:8080/api'
-        url_sentiment = url_base + '/analysis/sentiment-analysis/'
-        url_auth = url_base + '/auth/'
-        headers = {'Authorization': 'JWT ' + self.config['inhouse']['api_key']}
-        tweet_texts = []
-        for tweet in tweets:
-            tweet_texts.append(tweet['text'] + ' -$%#$&- {0}'.format(tweet['id']))
-        parameters = {'neu_inf_lim': -0.3, 'neu_sup_lim': 0.3, 'language': 'spanish'}
-        data = {'name': (None, 'politic-bots'),
-                'parameters': (None, json.dumps(parameters), 'application/json'),
-                'data_object': (None, json.dumps(tweet_texts), 'application/json')
-                }
-        ret = []
+        return self.__analyze_with_cache(tweets, self.__remote_sentiment_analysis, self.remote_version)
+
+    def lexicon_sentiment_analysis(self, tweets):
+        if self.__lexicon_analyzer is None:
+            self.__lexicon_analyzer = LexiconSentimentAnalyzer(self.config.get('lexicon'),
+                                                               self.REMOTE_PARAMETERS['neu_inf_lim'],
+                                                               self.REMOTE_PARAMETERS['neu_sup_lim'])
+        results = self.__lexicon_analyzer.analyze_docs(self.__get_tweet_texts(tweets))
+        return self.__process_results(results)
+
+    def __get_remote_client(self):
+        if self.__remote_client is None:
+            self.__remote_client = RemoteSentimentClient(self.config, self.config_file_name,
+                                                         dict(self.REMOTE_PARAMETERS, language=self.language))
+        return self.__remote_client
+
+    def __remote_sentiment_analysis(self, tweets):
+        tweet_texts = self.__get_tweet_texts(tweets)
         logging.info('Computing the sentiment of {0} tweets'.format(len(tweet_texts)))
-        resp = requests.post(url_sentiment, headers=headers, files=data)
-        if resp.status_code in error_codes:
-            # have to renew the api token
-            body_auth = {'username': self.config['inhouse']['username'],
-                         'password': self.config['inhouse']['password']}
-            resp = requests.post(url_auth, data=body_auth)
-            if resp.status_code in accepted_codes:
-                resp_json = resp.json()
-                api_token = resp_json['token']
-                self.config['inhouse']['api_key'] = api_token
-                update_config(self.config_file_name, self.config)
-                resp = requests.post(url_sentiment, headers=headers, files=data)
-            else:
-                raise Exception('Error {0} when trying to renew the token of the api'.format(resp.status_code))
-        if resp.status_code in accepted_codes:
-            resp_json = resp.json()
-            get_url = url_sentiment+str(resp_json['id'])+'/'
-            results = []
-            # wait some time before trying to get
-            # the results
-            time.sleep(60)
-            while len(results) == 0:
-                # wait some time before trying to
-                # get the results
-                time.sleep(30)
-                resp = requests.get(get_url, headers=headers)
-                if resp.status_code in accepted_codes:
-                    resp_json = resp.json()
-                    results = json.loads(resp_json['result'])
-                else:
-                    raise Exception('Got an unexpected response, code: {0}'.format(resp.status_code))
+        ret = []
+        for results in self.__get_remote_client().analyze_batches([tweet_texts]):
             logging.info('Obtained the results of sentiment analysis, now the results are going to be processed...')
             ret = self.__process_results(results)
-        else:
-            logging.error('Error {0} when trying to compute the sentiment of the tweets'.format(resp.status_code))
         logging.info('Computed correctly the sentiment of {0} tweets'.format(len(tweet_texts)))
         return ret
 
@@ -255,13 +415,346 @@ class SentimentAnalysis:
         return ret
 
 
+class LexiconSentimentAnalyzer:
+    """
+    Fast sentiment scorer based on a lexicon of words with polarities between -1 and 1.
+    The vocabulary is compiled once, every batch of texts is turned into a sparse
+    document-term matrix and scored with a single product by the vector of polarities.
+    The score of a text is the mean polarity of its words found in the lexicon
+    """
+    default_lexicon = pathlib.Path(__file__).parent.joinpath('lexicon_es.csv')
+    # urls and mentions do not carry sentiment
+    ignored_tokens = re.compile(r'https?://\S+|@\w+')
+    word_token = re.compile(r'\w+')
+
+    def __init__(self, lexicon_file=None, neu_inf_lim=-0.3, neu_sup_lim=0.3):
+        self.neu_inf_lim = neu_inf_lim
+        self.neu_sup_lim = neu_sup_lim
+        self.lexicon_file = pathlib.Path(lexicon_file) if lexicon_file else self.default_lexicon
+        self.vocabulary = {}
+        polarities = []
+        with open(str(self.lexicon_file), 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                word = self.__normalize(row['word'].strip())
+                if word not in self.vocabulary:
+                    self.vocabulary[word] = len(polarities)
+                    polarities.append(float(row['score']))
+        self.polarities = np.array(polarities)
+
+    def __normalize(self, text):
+        # lowercase and without accents, so the lexicon matches the informal writing of tweets
+        text = unicodedata.normalize('NFKD', text.lower())
+        return ''.join(c for c in text if not unicodedata.combining(c))
+
+    def get_doc_term_matrix(self, texts):
+        """
+        :param texts: list of texts
+        :return: sparse matrix (texts x vocabulary) with the number of occurrences of every word
+        """
+        indptr, indices = array('i', [0]), array('i')
+        for text in texts:
+            for token in self.word_token.findall(self.__normalize(self.ignored_tokens.sub(' ', text))):
+                if token in self.vocabulary:
+                    indices.append(self.vocabulary[token])
+            indptr.append(len(indices))
+        data = np.ones(len(indices))
+        return sparse.csr_matrix((data, np.frombuffer(indices, dtype=np.int32), np.frombuffer(indptr, dtype=np.int32)),
+                                 shape=(len(texts), len(self.vocabulary)))
+
+    def score_docs(self, texts):
+        """
+        :param texts: list of texts
+        :return: array with the scores of the texts, 0 for texts without words of the lexicon
+        """
+        doc_term = self.get_doc_term_matrix(texts)
+        total_polarity = doc_term.dot(self.polarities)
+        matched_words = np.asarray(doc_term.sum(axis=1)).ravel()
+        return np.divide(total_polarity, matched_words, out=np.zeros(len(texts)), where=matched_words > 0)
+
+    def analyze_docs(self, texts):
+        """
+        :param texts: list of texts
+        :return: list of tuples (text, tone, score), as the tagged docs of cca_core,
+        tone is pos, neg or neu
+        """
+        tagged_docs = []
+        for text, score in zip(texts, self.score_docs(texts)):
+            if score > self.neu_sup_lim:
+                tone = 'pos'
+            elif score < self.neu_inf_lim:
+                tone = 'neg'
+            else:
+                tone = 'neu'
+            tagged_docs.append((text, tone, float(score)))
+        return tagged_docs
+
+
+class RemoteSentimentClient:
+    """
+    Client of the in-house sentiment analysis api. Batches of texts are submitted as jobs,
+    up to max_jobs of them are kept in flight and polled concurrently with a delay that
+    grows while the results are not ready, and an expired token is renewed only once
+    for all the pending requests. The http calls are blocking, so they run in threads
+    driven by an asyncio loop
+    """
+    accepted_codes = [200, 201, 202]
+    error_codes = [400, 401]
+    default_url_base = 'http://159.203.77.35:8080/api'
+
+    def __init__(self, config, config_file_name, parameters, max_jobs=4, first_poll_delay=10, max_poll_delay=120,
+                 backoff_factor=1.5):
+        """
+        :param config: configuration of the project, the section inhouse has the credentials of
+        the api and optionally its url (url_base)
+        :param config_file_name: file where the renewed tokens are saved
+        :param parameters: parameters of the sentiment analysis
+        :param max_jobs: maximum number of jobs in flight
+        :param first_poll_delay: seconds to wait before asking for the results of a job the first time
+        :param max_poll_delay: maximum number of seconds between two polls of the same job
+        :param backoff_factor: factor by which the delay between polls grows
+        """
+        self.config = config
+        self.config_file_name = config_file_name
+        self.parameters = parameters
+        self.max_jobs = max_jobs
+        self.first_poll_delay = first_poll_delay
+        self.max_poll_delay = max_poll_delay
+        self.backoff_factor = backoff_factor
+        url_base = config['inhouse'].get('url_base', self.default_url_base).rstrip('/')
+        self.url_sentiment = url_base + '/analysis/sentiment-analysis/'
+        self.url_auth = url_base + '/auth/'
+        self.__session = requests.Session()
+        self.__executor = None
+        self.__token_lock = None
+
+    async def __renew_token(self, expired_token):
+        async with self.__token_lock:
+            if self.config['inhouse']['api_key'] != expired_token:
+                # another request has already renewed it
+                return
+            body_auth = {'username': self.config['inhouse']['username'],
+                         'password': self.config['inhouse']['password']}
+            resp = await asyncio.get_event_loop().run_in_executor(
+                self.__executor, partial(self.__session.post, self.url_auth, data=body_auth))
+            if resp.status_code in self.accepted_codes:
+                self.config['inhouse']['api_key'] = resp.json()['token']
+                update_config(self.config_file_name, self.config)
+            else:
+                raise Exception('Error {0} when trying to renew the token of the api'.format(resp.status_code))
+
+    async def __request(self, method, url, **kwargs):
+        renewed_token = False
+        while True:
+            api_token = self.config['inhouse']['api_key']
+            headers = {'Authorization': 'JWT ' + api_token}
+            resp = await asyncio.get_event_loop().run_in_executor(
+                self.__executor, partial(self.__session.request, method, url, headers=headers, **kwargs))
+            if resp.status_code in self.error_codes and not renewed_token:
+                # have to renew the api token
+                await self.__renew_token(api_token)
+                renewed_token = True
+                continue
+            return resp
+
+    async def __run_job(self, tweet_texts):
+        data = {'name': (None, 'politic-bots'),
+                'parameters': (None, json.dumps(self.parameters), 'application/json'),
+                'data_object': (None, json.dumps(tweet_texts), 'application/json')
+                }
+        resp = await self.__request('post', self.url_sentiment, files=data)
+        if resp.status_code not in self.accepted_codes:
+            logging.error('Error {0} when trying to compute the sentiment of the tweets'.format(resp.status_code))
+            return []
+        get_url = self.url_sentiment + str(resp.json()['id']) + '/'
+        poll_delay = self.first_poll_delay
+        while True:
+            # wait some time before trying to get the results
+            await asyncio.sleep(poll_delay)
+            resp = await self.__request('get', get_url)
+            if resp.status_code not in self.accepted_codes:
+                raise Exception('Got an unexpected response, code: {0}'.format(resp.status_code))
+            result = resp.json().get('result')
+            results = json.loads(result) if result else []
+            if results:
+                return results
+            poll_delay = min(poll_delay * self.backoff_factor, self.max_poll_delay)
+
+    async def __run_slot(self, job_id, tweet_texts, slots, results_queue):
+        try:
+            results = await self.__run_job(tweet_texts) if tweet_texts else []
+            results_queue.put((job_id, results))
+        finally:
+            slots.release()
+
+    async def __run_jobs(self, texts_batches, results_queue):
+        self.__token_lock = asyncio.Lock()
+        loop = asyncio.get_event_loop()
+        slots = asyncio.Semaphore(self.max_jobs)
+        texts_batches = iter(texts_batches)
+        jobs = []
+        while True:
+            await slots.acquire()
+            # the batches can come from the db, so they are read in a thread too
+            tweet_texts = await loop.run_in_executor(self.__executor, next, texts_batches, None)
+            if tweet_texts is None:
+                break
+            jobs.append(asyncio.ensure_future(self.__run_slot(len(jobs), tweet_texts, slots, results_queue)))
+        await asyncio.gather(*jobs)
+
+    def __run_loop(self, texts_batches, results_queue):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.__executor = ThreadPoolExecutor(self.max_jobs + 1)
+        try:
+            loop.run_until_complete(self.__run_jobs(texts_batches, results_queue))
+            results_queue.put((None, None))
+        except Exception as e:
+            results_queue.put((None, e))
+        finally:
+            self.__executor.shutdown()
+            loop.close()
+
+    def analyze_batches(self, texts_batches):
+        """
+        Compute the sentiment of batches of texts, each batch is a job of the api
+
+        :param texts_batches: iterable of lists of texts, it is consumed as jobs finish
+        :return: generator of the results of every batch, in the same order of the batches,
+        each result is yielded as soon as the job and those of the previous batches are done
+        """
+        results_queue = queue.Queue()
+        loop_thread = threading.Thread(target=self.__run_loop, args=(texts_batches, results_queue), daemon=True)
+        loop_thread.start()
+        finished_jobs, next_job = {}, 0
+        while True:
+            job_id, results = results_queue.get()
+            if job_id is None:
+                if results is not None:
+                    raise results
+                break
+            finished_jobs[job_id] = results
+            while next_job in finished_jobs:
+                yield finished_jobs.pop(next_job)
+                next_job += 1
+        loop_thread.join()
+
+
+def _run_analyzer(analyzer, tweet_texts):
+    if not tweet_texts:
+        return []
+    # start from an empty list of tagged docs so the
+    # results of previous batches are not returned again
+    analyzer.tagged_docs = []
+    analyzer.analyze_docs(tweet_texts)
+    return analyzer.tagged_docs
+
+
+# Analyzer of the current worker process, it is loaded
+# once by _init_sentiment_worker and reused for every batch
+_sentiment_analyzer = None
+
+
+def _init_sentiment_worker(language):
+    global _sentiment_analyzer
+    _sentiment_analyzer = SentimentAnalyzer(language=language)
+
+
+def _analyze_docs(tweet_texts):
+    return _run_analyzer(_sentiment_analyzer, tweet_texts)
+
+
+class URLResolver:
+    """
+    Resolver of the final url of links (e.g., shortened links). Redirects are followed with
+    HEAD requests, so bodies are not downloaded, at most max_per_host requests are sent to
+    the same host at once, up to concurrency in total, and resolved urls are saved in the
+    collection resolved_urls to be reused in later runs
+    """
+    accepted_codes = [200, 201, 202]
+    # codes of servers that do not support HEAD requests
+    head_not_allowed_codes = [403, 405, 501]
+
+    def __init__(self, concurrency=20, max_per_host=4, timeout=10):
+        self.concurrency = concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.__dbm_cache = DBManager('resolved_urls')
+        # connections are kept open and reused per host
+        self.__session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=max_per_host)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+
+    def __resolve_url(self, url):
+        try:
+            resp = self.__session.head(url, allow_redirects=True, timeout=self.timeout)
+            if resp.status_code in self.head_not_allowed_codes:
+                # only the headers are read
+                resp = self.__session.get(url, allow_redirects=True, timeout=self.timeout, stream=True)
+                resp.close()
+            if resp.status_code in self.accepted_codes:
+                return resp.url
+            logging.info('Got the code {0} when resolving the url {1}'.format(resp.status_code, url))
+        except requests.RequestException as e:
+            logging.info('Error when resolving the url {0}: {1}'.format(url, e))
+        return None
+
+    async def __resolve(self, url, executor, total_slots, host_slots):
+        async with host_slots[urlsplit(url).netloc]:
+            async with total_slots:
+                return await asyncio.get_event_loop().run_in_executor(executor, self.__resolve_url, url)
+
+    async def __resolve_all(self, urls, executor):
+        total_slots = asyncio.Semaphore(self.concurrency)
+        host_slots = defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+        return await asyncio.gather(*[self.__resolve(url, executor, total_slots, host_slots) for url in urls])
+
+    def resolve_urls(self, urls, batch_size=1000):
+        """
+        Get the final url of the given urls, those already resolved are taken from the
+        cache and the rest are resolved concurrently
+
+        :param urls: iterable of urls
+        :param batch_size: number of urls looked up and saved per operation in the cache
+        :return: dictionary url -> final url, the url itself if it could not be resolved
+        """
+        urls = list(set(urls))
+        final_urls = {}
+        for i in range(0, len(urls), batch_size):
+            for cache_reg in self.__dbm_cache.search({'_id': {'$in': urls[i:i+batch_size]}}):
+                final_urls[cache_reg['_id']] = cache_reg['final_url']
+        urls_to_resolve = [url for url in urls if url not in final_urls]
+        logging.info('{0} urls found in the cache, resolving the other {1}...'.format(len(final_urls),
+                                                                                     len(urls_to_resolve)))
+        if urls_to_resolve:
+            loop = asyncio.new_event_loop()
+            executor = ThreadPoolExecutor(self.concurrency)
+            try:
+                resolved_urls = loop.run_until_complete(self.__resolve_all(urls_to_resolve, executor))
+            finally:
+                executor.shutdown()
+                loop.close()
+            # urls that could not be resolved are not cached, so they are tried again next time
+            updates = [UpdateOne({'_id': url}, {'$set': {'final_url': final_url, 'resolved_at': datetime.utcnow()}},
+                                 upsert=True)
+                       for url, final_url in zip(urls_to_resolve, resolved_urls) if final_url]
+            for i in range(0, len(updates), batch_size):
+                self.__dbm_cache.bulk_write(updates[i:i+batch_size])
+            for url, final_url in zip(urls_to_resolve, resolved_urls):
+                final_urls[url] = final_url if final_url else url
+        return final_urls
+
+
 class LinkAnalyzer:
     tweets_with_links = None
     db_tweets = None
     accepted_codes = [200, 201, 202]
+    BATCH_SIZE = 1000
 
-    def __init__(self):
+    def __init__(self, concurrency=20, max_per_host=4):
         self.db_tweets = DBManager('tweets')
+        self.url_resolver = URLResolver(concurrency, max_per_host)
+        self.domain_normalizer = DomainNormalizer()
 
     def get_domains_and_freq(self, save_to_file=False, **kwargs):
         self.tweets_with_links = self.db_tweets.get_tweets_with_links(**kwargs)
@@ -269,44 +762,30 @@ class LinkAnalyzer:
         domains_url = defaultdict(list)
         domains = defaultdict(int)
         logging.info('Extracting the links of {0} tweets...'.format(total_tweets))
-        tweet_counter = 0
+        tweet_urls = [url['expanded_url'] for tweet_obj in self.tweets_with_links
+                      if 'entities' in tweet_obj['tweet_obj']
+                      for url in tweet_obj['tweet_obj']['entities']['urls'] if url['expanded_url']]
+        final_urls = self.url_resolver.resolve_urls(tweet_urls)
+        updates = []
         for tweet_obj in self.tweets_with_links:
             tweet = tweet_obj['tweet_obj']
-            tweet_counter += 1
-            logging.info('Tweet {0} out of {1}'.format(tweet_counter, total_tweets))
             curret_tweet_domains = set()
             if 'entities' in tweet:
                 for url in tweet['entities']['urls']:
                     tweet_url = url['expanded_url']
-                    logging.info('Analyzing the url {0}'.format(tweet_url))
-                    url_obj = tldextract.extract(tweet_url)
-                    domain_name = url_obj.domain
-                    # overwrite the domain name if some known abbreviations are found
-                    if domain_name == 'fb':
-                        domain_name = 'facebook'
-                    if domain_name == 'youtu':
-                        domain_name = 'youtube'
-                    if domain_name in domains_url.keys():
-                        domains_url[domain_name].append(tweet_url)
-                        domains[domain_name] += 1
-                        curret_tweet_domains.add(domain_name)
+                    if not tweet_url:
                         continue
-                    try:
-                        resp = requests.get(tweet_url)
-                        if resp.status_code in self.accepted_codes:
-                            url_obj = tldextract.extract(resp.url)
-                        else:
-                            url_obj = tldextract.extract(tweet_url)
-                    except:
-                        url_obj = tldextract.extract(tweet_url)
-                    domain_name = url_obj.domain
+                    domain_name = self.domain_normalizer.get_domain(final_urls[tweet_url])
                     domains_url[domain_name].append(tweet_url)
                     domains[domain_name] += 1
                     curret_tweet_domains.add(domain_name)
-                self.db_tweets.update_record({'tweet_obj.id_str': tweet['id_str']},
-                                             {'domains': list(curret_tweet_domains)})
+                updates.append(UpdateOne({'_id': tweet_obj['_id']}, {'$set': {'domains': list(curret_tweet_domains)}}))
+                if len(updates) == self.BATCH_SIZE:
+                    self.db_tweets.bulk_write(updates)
+                    updates = []
             else:
                 logging.info('Tweet without entities {0}'.format(tweet))
+        self.db_tweets.bulk_write(updates)
         if save_to_file:
             # Save results into a json file
             file_name = pathlib.Path(__file__).parents[2].joinpath('reports', 'tweet_domains.json')
@@ -315,75 +794,95 @@ class LinkAnalyzer:
         return domains_url, sorted(domains.items(), key=lambda k_v: k_v[1], reverse=True)
 
 
+class AuthorAttributes:
+    """
+    In-memory table of the party, movement and bot probability (pbb) of every user, loaded
+    with a single projected scan of the collection users, so the attributes of the authors
+    of tweets are not queried one by one
+    """
+    PROJECTION = {'screen_name': 1, 'party': 1, 'movement': 1, 'bot_analysis.pbb': 1}
+    BATCH_SIZE = 5000
+
+    def __init__(self, db_users=None):
+        self.db_users = db_users if db_users else DBManager('users')
+        self.__attributes = None
+
+    def load(self):
+        """
+        Load, or reload if the users have changed, the attributes of the users
+        """
+        attributes = {}
+        for users in self.db_users.iterate_by_id({}, self.BATCH_SIZE, self.PROJECTION):
+            for user in users:
+                attributes[user['screen_name']] = (user.get('party'), user.get('movement'),
+                                                   user.get('bot_analysis', {}).get('pbb'))
+        self.__attributes = attributes
+        logging.info('Loaded the attributes of {0} users'.format(len(attributes)))
+
+    def get(self, screen_name):
+        """
+        :param screen_name: screen name of the user
+        :return: tuple (party, movement, pbb) of the user or None if the user is not in the db
+        """
+        if self.__attributes is None:
+            self.load()
+        return self.__attributes.get(screen_name)
+
+    def items(self):
+        """
+        :return: iterator of tuples (screen name, (party, movement, pbb))
+        """
+        if self.__attributes is None:
+            self.load()
+        return self.__attributes.items()
+
+    def get_party(self, screen_name):
+        attributes = self.get(screen_name)
+        return attributes[0] if attributes else None
+
+    def get_movement(self, screen_name):
+        attributes = self.get(screen_name)
+        return attributes[1] if attributes else None
+
+    def get_pbb(self, screen_name):
+        attributes = self.get(screen_name)
+        return attributes[2] if attributes else None
+
+
 class UserInteractions:
-    db_tweets, db_users = None, None
+    db_tweets, db_users, db_interactions = None, None, None
+    BATCH_SIZE = 1000
+    INDEX_RESUME_TOKEN = 'interaction_index'
+    # last tweet of the latest complete build, saved with the number of relevant tweets up to it
+    INDEX_CHECKPOINT = 'interaction_index_checkpoint'
+    # saved while the increments of a batch are being written
+    INDEX_BATCH_TOKEN = 'interaction_index_batch'
+    INDEX_PROJECTION = {'tweet_py_date': 1, 'tweet_obj.user.screen_name': 1, 'tweet_obj.in_reply_to_screen_name': 1,
+                        'tweet_obj.in_reply_to_status_id_str': 1, 'tweet_obj.quoted_status.id_str': 1,
+                        'tweet_obj.quoted_status.user.screen_name': 1, 'tweet_obj.retweeted_status.id_str': 1,
+                        'tweet_obj.retweeted_status.user.screen_name': 1,
+                        'tweet_obj.entities.user_mentions.screen_name': 1}
 
-    def __init__(self):
+    def __init__(self, author_attributes=None):
         self.db_tweets = DBManager('tweets')
         self.db_users = DBManager('users')
+        self.db_interactions = DBManager('interactions')
+        self.author_attributes = author_attributes if author_attributes else AuthorAttributes(self.db_users)
 
     def __get_user_party(self, user_screen_name):
-        user = self.db_users.search({'screen_name': user_screen_name})
-        try:
-            party =  user[0]['party']
-            return party if party else 'desconocido'
-        except IndexError:
-            return 'desconocido'
+        party = self.author_attributes.get_party(user_screen_name)
+        return party if party else 'desconocido'
 
     def __get_user_movement(self, user_screen_name):
-        user = self.db_users.search({'screen_name': user_screen_name})
-        try:
-            movement = user[0]['movement']
-            if movement:
-                return movement
-            else:
-                return 'desconocido'
-        except IndexError:
-            return 'desconocido'
-
-    def __user_belong_party_movement(self, party, movement, tweet_author, tweet_authors):
-        if not party and not movement:
-            return True, tweet_authors
-        party = party.lower()
-        movement = movement.lower()
-        if tweet_authors[tweet_author]:
-            tweet_author_party, tweet_author_movement = tweet_authors[tweet_author]['party'], \
-                                                        tweet_authors[tweet_author]['movement']
-        else:
-            tweet_author_party, tweet_author_movement = 'desconocido', 'desconocido'
-        if party and tweet_author_party == 'desconocido':
-            logging.info('Need to get the party of the user {0}'.format(tweet_author))
-            tweet_author_party = self.__get_user_party(tweet_author)
-            if tweet_authors[tweet_author]:
-                tweet_authors[tweet_author]['party'] = tweet_author_party
-            else:
-                tweet_authors[tweet_author] = {'party': tweet_author_party, 'movement': 'desconocido'}
-        if movement and tweet_author_movement == 'desconocido':
-            logging.info('Need to get the movement of the user {0}'.format(tweet_author))
-            tweet_author_movement = self.__get_user_movement(tweet_author)
-            if tweet_authors[tweet_author]:
-                tweet_authors[tweet_author]['movement'] = tweet_author_movement
-            else:
-                tweet_authors[tweet_author] = {'party': 'desconocido', 'movement': tweet_author_movement}
-        if party and movement:
-            if party == tweet_author_party and movement == tweet_author_movement:
-                return True, tweet_authors
-            else:
-                return False, tweet_authors
-        else:
-            if party:
-                if party == tweet_author_party:
-                    return True, tweet_authors
-                else:
-                    return False, tweet_authors
-            else:
-                if movement:
-                    if movement == tweet_author_movement:
-                        return True, tweet_authors
-                    else:
-                        return False, tweet_authors
-                else:
-                    return False, tweet_authors
+        movement = self.author_attributes.get_movement(user_screen_name)
+        return movement if movement else 'desconocido'
+
+    def __user_belong_party_movement(self, party, movement, tweet_author):
+        if party and party.lower() != self.__get_user_party(tweet_author):
+            return False
+        if movement and movement.lower() != self.__get_user_movement(tweet_author):
+            return False
+        return True
 
     def __get_mentions_in_tweet(self, tweet_obj):
         user_mentions = []
@@ -392,63 +891,155 @@ class UserInteractions:
                 user_mentions.append(mention['screen_name'])
         return user_mentions
 
-    def __process_tweet(self, tweet, type_tweet, interactions):
-        for interaction in interactions:
-            if interaction['date'] == tweet['tweet_py_date'] and interaction['type'] == type_tweet:
-                interaction['count'] += 1
-                return interactions
-        interactions.append({'date': tweet['tweet_py_date'], 'type': type_tweet, 'count': 1})
+    def __get_interactions_in_tweet(self, tweet_obj):
+        """
+        Get the users who receive an interaction in the tweet. A user receives a single
+        interaction per tweet, whose type is, in this order of precedence, reply, quote,
+        retweet or mention. Interactions of the author of the tweet with themselves are discarded
+
+        :param tweet_obj: tweet
+        :return: dictionary target user -> (type of interaction, id of the target tweet or None)
+        """
+        interactions = {}
+        if tweet_obj.get('in_reply_to_screen_name'):
+            interactions[tweet_obj['in_reply_to_screen_name']] = ('reply', tweet_obj.get('in_reply_to_status_id_str'))
+        for type_tweet, status_key in [('quote', 'quoted_status'), ('retweet', 'retweeted_status')]:
+            if status_key in tweet_obj.keys():
+                target = tweet_obj[status_key]['user']['screen_name']
+                if target not in interactions:
+                    interactions[target] = (type_tweet, tweet_obj[status_key]['id_str'])
+        for mention in self.__get_mentions_in_tweet(tweet_obj):
+            if mention not in interactions:
+                interactions[mention] = ('mention', None)
+        interactions.pop(tweet_obj['user']['screen_name'], None)
         return interactions
 
-    def get_inter_received_user(self, user_screen_name, party=None, movement=None, exclude_tweet=None):
-        tweets = self.db_tweets.search({})
-        interactions_user = []
-        tweet_authors = defaultdict(dict)
-        total_tweets = tweets.count()
+    def __count_relevant_tweets_until(self, last_id):
+        return self.db_tweets.search({'relevante': 1, '_id': {'$lte': last_id}}, only_relevant_tws=False).count()
+
+    def is_interaction_index_complete(self):
+        return self.db_tweets.get_resume_token(self.INDEX_RESUME_TOKEN) is None and \
+               self.db_tweets.get_resume_token(self.INDEX_BATCH_TOKEN) is None and \
+               self.db_tweets.get_resume_token(self.INDEX_CHECKPOINT) is not None
+
+    def build_interaction_index(self, rebuild=False):
+        """
+        Build the collection interactions, an index of the interactions received by users
+        computed in a single pass over the relevant tweets. There is a record per target,
+        source, type of interaction and date, with the number of interactions (count) and,
+        for replies, quotes and retweets, the number of interactions per target tweet
+        (target_tweets). An interrupted build is resumed after the last batch whose interactions
+        were completely written, or rebuilt if it was interrupted while writing a batch.
+        Once built, calling it again adds the relevant tweets stored after the last build, and
+        the index is rebuilt if the number of relevant tweets already indexed has changed
+        (e.g., retweets flagged after their original or flags re-evaluated)
+
+        :param rebuild: discard the index and build it again from all the relevant tweets
+        """
+        if not rebuild and self.db_tweets.get_resume_token(self.INDEX_BATCH_TOKEN) is not None:
+            # the increments of the batch may have been partially written, resuming would count them twice
+            logging.warning('The index of interactions was interrupted while writing a batch, rebuilding it')
+            rebuild = True
+        checkpoint = self.db_tweets.get_resume_token(self.INDEX_CHECKPOINT)
+        in_progress = self.db_tweets.get_resume_token(self.INDEX_RESUME_TOKEN) is not None
+        if checkpoint is not None and not in_progress and not rebuild:
+            num_indexed = self.db_tweets.get_resume_token(self.INDEX_CHECKPOINT, 'num_relevant')
+            num_relevant = self.__count_relevant_tweets_until(checkpoint)
+            if num_indexed != num_relevant:
+                logging.warning('The relevance of tweets already indexed changed ({0} relevant tweets were indexed, '
+                                'now there are {1}), rebuilding the index of interactions'.format(num_indexed,
+                                                                                                  num_relevant))
+                rebuild = True
+        if rebuild or (checkpoint is None and not in_progress):
+            self.db_tweets.clear_resume_token(self.INDEX_RESUME_TOKEN)
+            self.db_tweets.clear_resume_token(self.INDEX_CHECKPOINT)
+            self.db_tweets.clear_resume_token(self.INDEX_BATCH_TOKEN)
+            self.db_interactions.clear_collection()
+            checkpoint = None
+        elif not in_progress:
+            # the update is iterated as the resumption of a build stopped at the checkpoint
+            self.db_tweets.save_resume_token(self.INDEX_RESUME_TOKEN, checkpoint)
+        self.db_interactions.create_index([('target', 1), ('source', 1), ('type', 1), ('date', 1)], unique=True)
         tweet_counter = 0
-        for tweet in tweets:
-            tweet_counter += 1
-            logging.info('Processing {0}/{1} tweets'.format(tweet_counter, total_tweets))
-            tweet_obj = tweet['tweet_obj']
-            # discard tweets posted by the given user
-            if tweet_obj['user']['screen_name'] == user_screen_name:
-                continue
-            # discard tweet users that do not belong to the given party and movement
-            belong_party_movement, tweet_authors = self.__user_belong_party_movement(party, movement,
-                                                                                     tweet_obj['user']['screen_name'],
-                                                                                     tweet_authors)
-            if not belong_party_movement:
+        last_id = checkpoint
+        for tweets in self.db_tweets.iterate_by_id({'relevante': 1}, self.BATCH_SIZE, self.INDEX_PROJECTION,
+                                                   resume_name=self.INDEX_RESUME_TOKEN):
+            counts = defaultdict(int)
+            target_tweets = defaultdict(lambda: defaultdict(int))
+            for tweet in tweets:
+                tweet_obj = tweet['tweet_obj']
+                source = tweet_obj['user']['screen_name']
+                for target, (type_tweet, id_target_tweet) in self.__get_interactions_in_tweet(tweet_obj).items():
+                    interaction_key = (target, source, type_tweet, tweet.get('tweet_py_date'))
+                    counts[interaction_key] += 1
+                    if id_target_tweet:
+                        target_tweets[interaction_key][id_target_tweet] += 1
+            updates = []
+            for interaction_key, count in counts.items():
+                increments = {'count': count}
+                for id_target_tweet, tweet_count in target_tweets[interaction_key].items():
+                    increments['target_tweets.' + id_target_tweet] = tweet_count
+                updates.append(UpdateOne(dict(zip(('target', 'source', 'type', 'date'), interaction_key)),
+                                         {'$inc': increments}, upsert=True))
+            last_id = tweets[-1]['_id']
+            # the batch is recorded as processed right after its writes, without
+            # waiting for iterate_by_id to do it when the next batch is requested
+            self.db_tweets.save_resume_token(self.INDEX_BATCH_TOKEN, last_id)
+            self.db_interactions.bulk_write(updates)
+            self.db_tweets.save_resume_token(self.INDEX_RESUME_TOKEN, last_id)
+            self.db_tweets.clear_resume_token(self.INDEX_BATCH_TOKEN)
+            tweet_counter += len(tweets)
+            logging.info('Indexed the interactions of {0} tweets'.format(tweet_counter))
+        # the index is complete up to the last indexed tweet
+        if last_id is not None:
+            self.db_tweets.save_resume_token(self.INDEX_CHECKPOINT, last_id,
+                                             num_relevant=self.__count_relevant_tweets_until(last_id))
+
+    def get_inter_received_users(self, user_screen_names, party=None, movement=None, exclude_tweet=None):
+        """
+        Get the interactions received by the given users per date and type of interaction. The
+        index of interactions is built, or its interrupted build finished, if it is not complete.
+        Tweets added after the last build are not considered until build_interaction_index is
+        called again
+
+        :param user_screen_names: list of screen names
+        :param party: if given, only interactions of users of this party are considered
+        :param movement: if given, only interactions of users of this movement are considered
+        :param exclude_tweet: id of a tweet of the given users whose interactions are discarded, replies
+        are matched by in_reply_to_status_id_str, quotes and retweets by the id_str of the original
+        :return: dictionary screen name -> list of dictionaries {'date', 'type', 'count'}
+        """
+        if not self.is_interaction_index_complete():
+            self.build_interaction_index()
+        interactions = defaultdict(lambda: defaultdict(int))
+        for interaction in self.db_interactions.search({'target': {'$in': list(user_screen_names)}}):
+            if not self.__user_belong_party_movement(party, movement, interaction['source']):
                 continue
-            # process replies to the given user
-            if tweet_obj['in_reply_to_screen_name'] == user_screen_name:
-                if not exclude_tweet or (exclude_tweet and tweet_obj['in_reply_to_status_id'] != exclude_tweet):
-                    interactions_user = self.__process_tweet(tweet, 'reply', interactions_user)
-            # process quotes to the given user
-            elif 'quoted_status' in tweet_obj.keys() and tweet_obj['quoted_status']['user']['screen_name'] == user_screen_name:
-                if not exclude_tweet or (exclude_tweet and tweet_obj['quoted_status']['id_str'] != exclude_tweet):
-                    interactions_user = self.__process_tweet(tweet, 'quote', interactions_user)
-            # process retweets to the given user's tweets
-            elif 'retweeted_status' in tweet_obj.keys() and tweet_obj['retweeted_status']['user']['screen_name'] == user_screen_name:
-                if not exclude_tweet or (exclude_tweet and tweet_obj['retweeted_status']['id_str'] != exclude_tweet):
-                    interactions_user = self.__process_tweet(tweet, 'retweet', interactions_user)
-            # process mentions to the given user if the tweet is not a reply. we are interested in
-            # original tweets that include the mention to the given user not in replies that by default
-            # include the screen name of the given user
-            else:
-                tweet_mentions = self.__get_mentions_in_tweet(tweet_obj)
-                if user_screen_name in tweet_mentions:
-                    interactions_user = self.__process_tweet(tweet, 'mention', interactions_user)
+            count = interaction['count']
+            if exclude_tweet:
+                count -= interaction.get('target_tweets', {}).get(str(exclude_tweet), 0)
+            if count:
+                interactions[interaction['target']][(interaction['date'], interaction['type'])] += count
+        return {user_screen_name: [{'date': date, 'type': type_tweet, 'count': count}
+                                   for (date, type_tweet), count in interactions[user_screen_name].items()]
+                for user_screen_name in user_screen_names}
 
-        return interactions_user
+    def get_inter_received_user(self, user_screen_name, party=None, movement=None, exclude_tweet=None):
+        return self.get_inter_received_users([user_screen_name], party, movement, exclude_tweet)[user_screen_name]
 
 
 class UserPoliticalPreference:
     db_tweets, db_users = None, None
+    BATCH_SIZE = 1000
+    PREFERENCE_PROJECTION = {'tweet_obj.user.screen_name': 1, 'tweet_obj.entities.hashtags.text': 1,
+                             'tweet_obj.retweeted_status.entities.hashtags.text': 1}
 
-    def __init__(self):
+    def __init__(self, author_attributes=None):
         self.db_tweets = DBManager('tweets')
         self.db_users = DBManager('users')
+        self.author_attributes = author_attributes if author_attributes else AuthorAttributes(self.db_users)
         self.hashtags, self.metadata = self.__get_hashtags_and_metadata()
+        self.hashtags_table = self.__get_hashtags_table()
 
     def __get_hashtags_and_metadata(self):
         script_parent_dir = pathlib.Path(__file__).parents[1]
@@ -464,6 +1055,18 @@ class UserPoliticalPreference:
                     hashtags.append(keyword.lower())
         return hashtags, metadata
 
+    def __get_hashtags_table(self):
+        # hashtag (lowercase) -> (party, movement) of the first row of the metadata
+        # that contains the hashtag, only for the hashtags of interest. Metadata files
+        # without the column movimiento (e.g., generales.csv) give no movement votes
+        hashtags = set(self.hashtags)
+        hashtags_table = {}
+        for metadata in self.metadata:
+            hashtag = metadata['keyword'].lower()
+            if hashtag in hashtags and hashtag not in hashtags_table:
+                hashtags_table[hashtag] = (metadata['partido_politico'], metadata.get('movimiento', ''))
+        return hashtags_table
+
     def __get_tweet_hashtags(self, tweet_obj):
         tweet_hashtags = []
         if 'entities' in tweet_obj.keys():
@@ -471,76 +1074,82 @@ class UserPoliticalPreference:
                 tweet_hashtags.append(hashtag['text'])
         return tweet_hashtags
 
-    def __get_hashtag_metadata(self, hashtag):
-        for metadata in self.metadata:
-            if metadata['keyword'].lower() == hashtag.lower():
-                return metadata
+    def count_votes(self, tweet_obj, party_votes, movement_votes):
+        # every hashtag of interest in the tweet, or in the original tweet if
+        # it is a retweet, is a vote for its party and movement
+        if 'retweeted_status' in tweet_obj.keys():
+            tweet_hashtags = self.__get_tweet_hashtags(tweet_obj['retweeted_status'])
+        else:
+            tweet_hashtags = self.__get_tweet_hashtags(tweet_obj)
+        for hashtag in tweet_hashtags:
+            hashtag_metadata = self.hashtags_table.get(hashtag.lower())
+            if hashtag_metadata:
+                party, movement = hashtag_metadata
+                if party:
+                    party_votes[party] += 1
+                if movement:
+                    movement_votes[movement] += 1
 
-    def get_user_political_movement(self, user_screen_name):
-        user_movement = None
-        user_political_preference = defaultdict(int)
+    def get_most_voted(self, votes):
+        # on ties, the first voted wins
+        if votes:
+            return max(votes.items(), key=lambda k_v: k_v[1])[0]
+        return None
+
+    def __get_user_votes(self, user_screen_name):
+        party_votes, movement_votes = defaultdict(int), defaultdict(int)
         filter = {
             'relevante': {'$eq': 1},
             'tweet_obj.user.screen_name': {'$eq': user_screen_name}
         }
-        results = self.db_tweets.search(filter)
-        for tweet in results:
-            tweet_obj = tweet['tweet_obj']
-            if 'retweeted_status' in tweet_obj.keys():
-                tweet_hashtags = self.__get_tweet_hashtags(tweet_obj['retweeted_status'])
-            else:
-                tweet_hashtags = self.__get_tweet_hashtags(tweet_obj)
-            for hashtag in tweet_hashtags:
-                if hashtag.lower() in self.hashtags:
-                    hashtag_metadata = self.__get_hashtag_metadata(hashtag)
-                    if hashtag_metadata['movimiento']:
-                        user_political_preference[hashtag_metadata['movimiento']] += 1
-        if user_political_preference:
-            s_user_political_preference = [k for k in sorted(user_political_preference.items(), key=lambda k_v: k_v[1],
-                                           reverse=True)]
-            user_movement = s_user_political_preference[0][0]
-        return user_movement
+        for tweet in self.db_tweets.search(filter):
+            self.count_votes(tweet['tweet_obj'], party_votes, movement_votes)
+        return party_votes, movement_votes
+
+    def get_user_political_movement(self, user_screen_name):
+        _, movement_votes = self.__get_user_votes(user_screen_name)
+        return self.get_most_voted(movement_votes)
 
     def get_user_political_party(self, user_screen_name):
-        user_party = None
-        user_political_preference = defaultdict(int)
-        filter = {
-            'relevante': {'$eq': 1},
-            'tweet_obj.user.screen_name': {'$eq': user_screen_name}
-        }
-        results = self.db_tweets.search(filter)
-        for tweet in results:
-            tweet_obj = tweet['tweet_obj']
-            if 'retweeted_status' in tweet_obj.keys():
-                tweet_hashtags = self.__get_tweet_hashtags(tweet_obj['retweeted_status'])
-            else:
-                tweet_hashtags = self.__get_tweet_hashtags(tweet_obj)
-            for hashtag in tweet_hashtags:
-                if hashtag.lower() in self.hashtags:
-                    hashtag_metadata = self.__get_hashtag_metadata(hashtag)
-                    if hashtag_metadata['partido_politico']:
-                        user_political_preference[hashtag_metadata['partido_politico']] += 1
-        if user_political_preference:
-            s_user_political_preference = [k for k in sorted(user_political_preference.items(), key=lambda k_v: k_v[1],
-                                                             reverse=True)]
-            user_party = s_user_political_preference[0][0]
-        return user_party
+        party_votes, _ = self.__get_user_votes(user_screen_name)
+        return self.get_most_voted(party_votes)
+
+    def __get_votes_of_users(self):
+        """
+        Count the votes for parties and movements of all the authors of
+        tweets in a single pass over the relevant tweets
+
+        :return: dictionary screen name -> (party votes, movement votes)
+        """
+        users_votes = defaultdict(lambda: (defaultdict(int), defaultdict(int)))
+        tweet_counter = 0
+        for tweets in self.db_tweets.iterate_by_id({'relevante': 1}, self.BATCH_SIZE, self.PREFERENCE_PROJECTION):
+            for tweet in tweets:
+                tweet_obj = tweet['tweet_obj']
+                party_votes, movement_votes = users_votes[tweet_obj['user']['screen_name']]
+                self.count_votes(tweet_obj, party_votes, movement_votes)
+            tweet_counter += len(tweets)
+            logging.info('Counted the political votes of {0} tweets'.format(tweet_counter))
+        return users_votes
 
     def update_users_political_preference(self, include_movement=True):
-        users = self.db_users.search({})
-        total_users = users.count()
+        users_votes = self.__get_votes_of_users()
         users_counter = 0
-        for user in users:
-            users_counter += 1
-            user_movement, user_party = None, None
-            logging.info('Processing {0}/{1} users'.format(users_counter, total_users))
-            if include_movement:
-                user_movement = self.get_user_political_movement(user['screen_name'])
-            user_party = self.get_user_political_party(user['screen_name'])
-            logging.info('User {0} demonstrates to support {1}, {2}'.format(user['screen_name'], user_party,
-                                                                            user_movement))
-            self.db_users.update_record({'screen_name': user['screen_name']}, {'party': user_party,
-                                                                               'movement': user_movement})
+        for users in self.db_users.iterate_by_id({}, self.BATCH_SIZE, {'screen_name': 1}):
+            updates = []
+            for user in users:
+                user_movement = None
+                party_votes, movement_votes = users_votes.get(user['screen_name'], ({}, {}))
+                if include_movement:
+                    user_movement = self.get_most_voted(movement_votes)
+                user_party = self.get_most_voted(party_votes)
+                logging.debug('User {0} demonstrates to support {1}, {2}'.format(user['screen_name'], user_party,
+                                                                                 user_movement))
+                updates.append(UpdateOne({'_id': user['_id']}, {'$set': {'party': user_party,
+                                                                         'movement': user_movement}}))
+            self.db_users.bulk_write(updates)
+            users_counter += len(users)
+            logging.info('Updated the political preference of {0} users'.format(users_counter))
 
     def update_user_most_interacted_party_movement(self, include_movement=True):
         users = self.db_users.search({})
@@ -561,52 +1170,51 @@ class UserPoliticalPreference:
                                         {'most_interacted_party': user_most_interacted_party,
                                          'most_interacted_movement': user_most_interacted_movement})
 
+    def __denormalize_author_attributes(self, default_fields, get_fields):
+        """
+        Copy attributes of the authors into their relevant tweets. As the values only depend
+        on the author, authors with the same values are updated together with an update_many.
+        The values of known authors are written before the defaults of unknown authors, so an
+        interruption never replaces the values already stored with the defaults
+
+        :param default_fields: fields of the tweets whose authors are not in the collection users
+        :param get_fields: function that receives the tuple (party, movement, pbb) of an author
+        and returns the fields to set in their tweets
+        """
+        # the attributes of users may have been just updated
+        self.author_attributes.load()
+        self.db_tweets.create_index('tweet_obj.user.screen_name')
+        authors_by_fields = defaultdict(list)
+        for screen_name, attributes in self.author_attributes.items():
+            authors_by_fields[tuple(sorted(get_fields(attributes).items()))].append(screen_name)
+        # authors of relevant tweets who are not in the collection users get the defaults
+        pipeline = [{'$match': {'relevante': 1}}, {'$group': {'_id': '$tweet_obj.user.screen_name'}}]
+        unknown_authors = [doc['_id'] for doc in self.db_tweets.aggregate(pipeline)
+                           if self.author_attributes.get(doc['_id']) is None]
+        updates = []
+        for fields, authors in list(authors_by_fields.items()) + [(default_fields.items(), unknown_authors)]:
+            for i in range(0, len(authors), self.BATCH_SIZE):
+                updates.append(UpdateMany({'relevante': 1,
+                                           'tweet_obj.user.screen_name': {'$in': authors[i:i+self.BATCH_SIZE]}},
+                                          {'$set': dict(fields)}))
+        logging.info('Updating the tweets of {0} known and {1} unknown authors with {2} operations'.format(
+            sum(len(authors) for authors in authors_by_fields.values()), len(unknown_authors), len(updates)))
+        for i in range(0, len(updates), self.BATCH_SIZE):
+            self.db_tweets.bulk_write(updates[i:i+self.BATCH_SIZE])
+
     def update_tweet_user_political_preference(self, include_movement=True):
-        tweets = self.db_tweets.search({})
-        tweet_authors = defaultdict(dict)
-        total_tweets = tweets.count()
-        tweet_counter = 0
-        for tweet in tweets:
-            tweet_counter += 1
-            logging.info('Processing {0}/{1} tweets'.format(tweet_counter, total_tweets))
-            tweet_obj = tweet['tweet_obj']
-            new_fields = {}
-            if tweet_obj['user']['screen_name'] not in tweet_authors.keys():
-                user = self.db_users.search({'screen_name': tweet_obj['user']['screen_name']})
-                try:
-                    new_fields['author_party'] = user[0]['party']
-                except IndexError:
-                    new_fields['author_party'] = None
-                if include_movement:
-                    try:
-                        new_fields.update({'author_movement': user[0]['movement']})
-                    except IndexError:
-                        new_fields.update({'author_movement': None})
-                tweet_authors[tweet_obj['user']['screen_name']] = new_fields
-            else:
-                new_fields = tweet_authors[tweet_obj['user']['screen_name']]
-            self.db_tweets.update_record({'tweet_obj.id_str': tweet_obj['id_str']}, new_fields)
+        if include_movement:
+            default_fields = {'author_party': None, 'author_movement': None}
+            self.__denormalize_author_attributes(default_fields, lambda attributes: {'author_party': attributes[0],
+                                                                                     'author_movement': attributes[1]})
+        else:
+            self.__denormalize_author_attributes({'author_party': None},
+                                                 lambda attributes: {'author_party': attributes[0]})
 
     def update_tweet_user_pbb(self):
-        tweets = self.db_tweets.search({})
-        tweet_authors = defaultdict(dict)
-        total_tweets = tweets.count()
-        tweet_counter = 0
-        for tweet in tweets:
-            tweet_counter += 1
-            logging.info('Processing {0}/{1} tweets'.format(tweet_counter, total_tweets))
-            tweet_obj = tweet['tweet_obj']
-            new_fields = {}
-            if tweet_obj['user']['screen_name'] not in tweet_authors.keys():
-                user = self.db_users.search({'screen_name': tweet_obj['user']['screen_name']})
-                try:
-                    new_fields['author_pbb'] = user[0]['bot_analysis']['pbb']
-                except IndexError:
-                    new_fields['author_party'] = -1
-                tweet_authors[tweet_obj['user']['screen_name']] = new_fields
-            else:
-                new_fields = tweet_authors[tweet_obj['user']['screen_name']]
-            self.db_tweets.update_record({'tweet_obj.id_str': tweet_obj['id_str']}, new_fields)
+        # users whose bot probability hasn't been computed get the default too
+        self.__denormalize_author_attributes({'author_pbb': -1}, lambda attributes: {
+            'author_pbb': attributes[2] if attributes[2] is not None else -1})
 
 
 if __name__ == '__main__':
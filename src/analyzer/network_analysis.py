@@ -1,280 +1,753 @@
+from array import array
 from collections import defaultdict
 from datetime import datetime
+from scipy import sparse
 from src.utils.db_manager import DBManager
+from src.utils.utils import get_config, update_config
 from src.analyzer.data_analyzer import UserPoliticalPreference
+from multiprocessing import Pool
+from pymongo import InsertOne, UpdateOne
+from xml.sax.saxutils import escape, quoteattr
+import gzip
 import logging
 import networkx as net
+import numpy as np
 import pathlib
+import time
 
 logging.basicConfig(filename=str(pathlib.Path(__file__).parents[1].joinpath('politic_bots.log')), level=logging.DEBUG)
 
+
+def _compute_ff_ratio(friends, followers):
+    if followers > 0 and friends > 0:
+        return friends / followers
+    else:
+        return 0
+
+
+def _get_node(user):
+    if 'ff_ratio' in user.keys():
+        ff_ratio = user['ff_ratio']
+    else:
+        ff_ratio = _compute_ff_ratio(user['friends'], user['followers'])
+    pbb_score = user['bot_analysis']['pbb'] if 'bot_analysis' in user.keys() else ''
+    return {'screen_name': user['screen_name'], 'party': user.get('party'), 'movement': user.get('movement'),
+            'ff_ratio': ff_ratio, 'pbb': pbb_score}
+
+
+def _get_ffratio(dbm_tweets, screen_name):
+    query = {
+        '$or': [
+            {'tweet_obj.user.screen_name': screen_name},
+            {'tweet_obj.retweeted_status.user.screen_name': screen_name},
+            {'tweet_obj.quoted_status.user.screen_name': screen_name}
+        ]
+    }
+    tweet_obj = dbm_tweets.find_record(query)
+    if tweet_obj:
+        tweet = tweet_obj['tweet_obj']
+        if 'retweeted_status' in tweet.keys():
+            return _compute_ff_ratio(tweet['retweeted_status']['user']['friends_count'],
+                                     tweet['retweeted_status']['user']['followers_count'])
+        elif 'quoted_status' in tweet.keys():
+            return _compute_ff_ratio(tweet['quoted_status']['user']['friends_count'],
+                                     tweet['quoted_status']['user']['followers_count'])
+        else:
+            return _compute_ff_ratio(tweet['user']['friends_count'],
+                                     tweet['user']['followers_count'])
+    else:
+        return None
+
+
+# State of the process that computes edges of the network, set by _init_network_worker
+_network_node_table = None
+_network_depth = 1
+_network_dbm_tweets = None
+
+
+def _init_network_worker(node_table, depth):
+    global _network_node_table, _network_depth, _network_dbm_tweets
+    _network_node_table = node_table
+    _network_depth = depth
+    # the db is only queried for users who are not in the node table
+    _network_dbm_tweets = DBManager('tweets') if depth > 1 else None
+
+
+def _get_network_of_users(users):
+    """
+    Get the nodes and edges of the interactions of the given users
+
+    :param users: list of users with their interactions
+    :return: tuple with a dictionary screen name -> node, a list of edges (source screen name,
+    target screen name, weight) and a set of interacted users that are not nodes of the network
+    """
+    nodes, edges, unknown_users = {}, [], set()
+    for user in users:
+        node = _network_node_table.get(user['screen_name']) or _get_node(user)
+        nodes[user['screen_name']] = node
+        for interacted_user, interactions in user['interactions'].items():
+            if interacted_user not in _network_node_table:
+                # users who are not in the db of users are added to the table, as nodes if
+                # their ff_ratio is found or as None otherwise, so they are looked up only once
+                i_ff_ratio = _get_ffratio(_network_dbm_tweets, interacted_user) if _network_depth > 1 else None
+                if i_ff_ratio:
+                    _network_node_table[interacted_user] = {'screen_name': interacted_user, 'party': None,
+                                                            'movement': None, 'ff_ratio': i_ff_ratio, 'pbb': ''}
+                else:
+                    _network_node_table[interacted_user] = None
+            inode = _network_node_table[interacted_user]
+            if not inode:
+                unknown_users.add(interacted_user)
+                continue
+            nodes[interacted_user] = inode
+            edges.append((user['screen_name'], interacted_user, interactions['total']))
+    return nodes, edges, unknown_users
+
+
+class NetworkWriter:
+    """
+    Streaming writer of networks in the GEXF or GraphML formats. Node ids are taken from a
+    dictionary screen name -> id, so each edge is written in constant time, labels and attribute
+    values are escaped, and the lines are written to the file in chunks instead of one by one
+    """
+    EXTENSIONS = {'gexf': '.gexf', 'graphml': '.graphml'}
+    # printf-style templates are used for the edges since they are faster to fill than format strings
+    EDGE_TEMPLATES = {'gexf': '<edge id="%d" source="%d" target="%d" weight="%s"/>\n',
+                      'graphml': '<edge id="e%d" source="n%d" target="n%d"><data key="weight">%s</data></edge>\n'}
+    NODE_ATTRIBUTES = [('party', 'string'), ('movement', 'string'), ('ff_ratio', 'float'), ('pbb', 'float')]
+    GRAPHML_TYPES = {'string': 'string', 'float': 'double'}
+    BUFFER_SIZE = 10000
+
+    def __init__(self, file_format='gexf', compress=False):
+        """
+        :param file_format: gexf or graphml
+        :param compress: whether to compress the file with gzip
+        """
+        if file_format not in self.EXTENSIONS:
+            raise Exception('Unknown network format {0}'.format(file_format))
+        self.file_format = file_format
+        self.compress = compress
+        self.__buffer = []
+        self.__file = None
+
+    def get_extension(self):
+        return self.EXTENSIONS[self.file_format] + ('.gz' if self.compress else '')
+
+    def __write(self, line):
+        self.__buffer.append(line)
+        if len(self.__buffer) >= self.BUFFER_SIZE:
+            self.__flush()
+
+    def __flush(self):
+        self.__file.write(''.join(self.__buffer))
+        self.__buffer = []
+
+    def __get_attribute_values(self, node):
+        # missing values (e.g., users without party or pbb) are left out
+        # instead of writing values that are not valid for their type
+        for attr_id, (attr_name, _) in enumerate(self.NODE_ATTRIBUTES):
+            value = node.get(attr_name)
+            if value is not None and value != '':
+                yield attr_id, str(value)
+
+    def __write_gexf_header(self, description):
+        today = datetime.strftime(datetime.now(), '%m/%d/%y')
+        self.__write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.__write('<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.1draft/viz" '
+                     'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                     'xsi:schemaLocation="http://www.gexf.net/1.2draft http://www.gexf.net/1.2draft/gexf.xsd" '
+                     'version="1.2">\n')
+        self.__write('<meta lastmodifieddate="{0}">\n'.format(today))
+        self.__write('<creator>PoliticBots</creator>\n')
+        self.__write('<description>{0}</description>\n'.format(escape(description)))
+        self.__write('</meta>\n')
+        self.__write('<graph mode="static" defaultedgetype="directed">\n')
+        self.__write('<attributes class="node">\n')
+        for attr_id, (attr_name, attr_type) in enumerate(self.NODE_ATTRIBUTES):
+            self.__write('<attribute id="{0}" title="{1}" type="{2}"/>\n'.format(attr_id, attr_name, attr_type))
+        self.__write('</attributes>\n')
+        self.__write('<nodes>\n')
+
+    def __write_gexf_node(self, node_id, node):
+        self.__write('<node id="{0}" label={1}>\n<attvalues>\n'.format(node_id, quoteattr(node['screen_name'])))
+        for attr_id, value in self.__get_attribute_values(node):
+            self.__write('<attvalue for="{0}" value={1}/>\n'.format(attr_id, quoteattr(value)))
+        self.__write('</attvalues>\n</node>\n')
+
+    def __write_graphml_header(self, description):
+        self.__write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.__write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+                     'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                     'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+                     'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        self.__write('<desc>{0}</desc>\n'.format(escape(description)))
+        self.__write('<key id="label" for="node" attr.name="label" attr.type="string"/>\n')
+        for attr_id, (attr_name, attr_type) in enumerate(self.NODE_ATTRIBUTES):
+            self.__write('<key id="d{0}" for="node" attr.name="{1}" attr.type="{2}"/>\n'.format(
+                attr_id, attr_name, self.GRAPHML_TYPES[attr_type]))
+        self.__write('<key id="weight" for="edge" attr.name="weight" attr.type="double"/>\n')
+        self.__write('<graph id="G" edgedefault="directed">\n')
+
+    def __write_graphml_node(self, node_id, node):
+        self.__write('<node id="n{0}">\n<data key="label">{1}</data>\n'.format(node_id, escape(node['screen_name'])))
+        for attr_id, value in self.__get_attribute_values(node):
+            self.__write('<data key="d{0}">{1}</data>\n'.format(attr_id, escape(value)))
+        self.__write('</node>\n')
+
+    def write(self, f_name, nodes, edges, description=''):
+        """
+        Write the network in a file
+
+        :param f_name: path of the file
+        :param nodes: iterable of nodes, dictionaries with the screen name and attributes of the users
+        :param edges: iterable of tuples (source screen name, target screen name, weight)
+        :param description: description of the network
+        :return: tuple with the number of nodes and edges written
+        """
+        if self.file_format == 'gexf':
+            write_header, write_node = self.__write_gexf_header, self.__write_gexf_node
+            closing_tags = ['</nodes>\n<edges>\n', '</edges>\n</graph>\n</gexf>\n']
+        else:
+            write_header, write_node = self.__write_graphml_header, self.__write_graphml_node
+            closing_tags = ['', '</graph>\n</graphml>\n']
+        edge_template = self.EDGE_TEMPLATES[self.file_format]
+        if self.compress:
+            self.__file = gzip.open(str(f_name), 'wt', encoding='utf-8')
+        else:
+            self.__file = open(str(f_name), 'w', encoding='utf-8')
+        node_ids = {}
+        edge_id = 0
+        try:
+            write_header(description)
+            for node in nodes:
+                if node['screen_name'] in node_ids:
+                    continue
+                node_ids[node['screen_name']] = len(node_ids)
+                write_node(node_ids[node['screen_name']], node)
+            self.__write(closing_tags[0])
+            # edges are the bulk of the file, so their lines are added to the buffer directly
+            for source, target, weight in edges:
+                self.__buffer.append(edge_template % (edge_id, node_ids[source], node_ids[target], weight))
+                edge_id += 1
+                if edge_id % self.BUFFER_SIZE == 0:
+                    self.__flush()
+            self.__write(closing_tags[1])
+            self.__flush()
+        finally:
+            self.__file.close()
+            self.__file, self.__buffer = None, []
+        return len(node_ids), edge_id
+
+
+class InteractionGraph:
+    """
+    Compact directed graph of interactions among users. Screen names are interned into consecutive
+    integer ids, the edges are kept in CSR form (indptr, indices, weights) and the attributes of
+    the nodes in arrays indexed by id, so an edge takes 8 bytes instead of a python object. The
+    arrays are saved as .npy files that can be loaded memory-mapped, which opens large graphs
+    without reading them and lets several processes share the same pages
+    """
+    ARRAYS = ['screen_names', 'indptr', 'indices', 'weights', 'party', 'movement', 'ff_ratio', 'pbb']
+    META_FILE = 'graph.json'
+
+    def __init__(self, arrays, party_values, movement_values):
+        """
+        :param arrays: dictionary with the arrays listed in ARRAYS
+        :param party_values: parties whose position is the code of the party array, -1 means no party
+        :param movement_values: movements whose position is the code of the movement array, -1 means no movement
+        """
+        for array_name in self.ARRAYS:
+            setattr(self, array_name, arrays[array_name])
+        self.party_values = list(party_values)
+        self.movement_values = list(movement_values)
+        self.__node_ids = None
+
+    @property
+    def num_nodes(self):
+        return len(self.screen_names)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def get_node_id(self, screen_name):
+        # the interner is built on first use so loading a graph doesn't read the screen names
+        if self.__node_ids is None:
+            self.__node_ids = {str(name): node_id for node_id, name in enumerate(self.screen_names)}
+        return self.__node_ids.get(screen_name)
+
+    def get_node(self, node_id):
+        party, movement, pbb = self.party[node_id], self.movement[node_id], self.pbb[node_id]
+        return {'screen_name': str(self.screen_names[node_id]),
+                'party': self.party_values[party] if party >= 0 else None,
+                'movement': self.movement_values[movement] if movement >= 0 else None,
+                'ff_ratio': float(self.ff_ratio[node_id]), 'pbb': '' if np.isnan(pbb) else float(pbb)}
+
+    def get_nodes(self):
+        for node_id in range(self.num_nodes):
+            yield self.get_node(node_id)
+
+    def get_out_edges(self, node_id):
+        """
+        :param node_id: id of the node
+        :return: tuple with the arrays of ids of the interacted nodes and the weights of the interactions
+        """
+        start, end = self.indptr[node_id], self.indptr[node_id+1]
+        return self.indices[start:end], self.weights[start:end]
+
+    def get_edges(self):
+        """
+        :return: generator of tuples (source screen name, target screen name, weight)
+        """
+        screen_names = [str(name) for name in self.screen_names]
+        for source in range(self.num_nodes):
+            targets, weights = self.get_out_edges(source)
+            for target, weight in zip(targets.tolist(), weights.tolist()):
+                yield screen_names[source], screen_names[target], weight
+
+    def to_networkx(self):
+        # as in the graphs built edge by edge, nodes without edges are left out
+        graph = net.DiGraph()
+        graph.add_weighted_edges_from(self.get_edges())
+        return graph
+
+    def save(self, directory):
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for array_name in self.ARRAYS:
+            np.save(str(directory.joinpath(array_name+'.npy')), getattr(self, array_name))
+        update_config(str(directory.joinpath(self.META_FILE)),
+                      {'num_nodes': self.num_nodes, 'num_edges': self.num_edges,
+                       'party_values': self.party_values, 'movement_values': self.movement_values})
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        :param directory: directory where the graph was saved
+        :param mmap_mode: mode in which the arrays are memory-mapped, None to read them into memory
+        :return: the graph
+        """
+        directory = pathlib.Path(directory)
+        meta = get_config(directory.joinpath(cls.META_FILE))
+        arrays = {array_name: np.load(str(directory.joinpath(array_name+'.npy')), mmap_mode=mmap_mode)
+                  for array_name in cls.ARRAYS}
+        return cls(arrays, meta['party_values'], meta['movement_values'])
+
+
+class InteractionGraphBuilder:
+    """
+    Accumulator of the nodes and edges of an InteractionGraph. The ends of the edges
+    are kept as ids in typed arrays until the graph is built
+    """
+
+    def __init__(self):
+        self.__node_ids = {}
+        self.__nodes = []
+        self.__sources = array('i')
+        self.__targets = array('i')
+        self.__weights = array('i')
+
+    def add_node(self, node):
+        node_id = self.__node_ids.get(node['screen_name'])
+        if node_id is None:
+            node_id = self.__node_ids[node['screen_name']] = len(self.__nodes)
+            self.__nodes.append(node)
+        return node_id
+
+    def add_edges(self, edges):
+        """
+        :param edges: iterable of tuples (source screen name, target screen name, weight), the
+        ends of the edges must have been added as nodes
+        """
+        for source, target, weight in edges:
+            self.__sources.append(self.__node_ids[source])
+            self.__targets.append(self.__node_ids[target])
+            self.__weights.append(int(weight))
+
+    def __get_codes(self, attr_name):
+        values = sorted({node[attr_name] for node in self.__nodes if node[attr_name]})
+        codes = {value: code for code, value in enumerate(values)}
+        return np.array([codes.get(node[attr_name], -1) for node in self.__nodes], dtype=np.int16), values
+
+    def build(self):
+        num_nodes = len(self.__nodes)
+        # repeated edges are summed up and the interacted nodes of each node sorted by the conversion
+        adjacency = sparse.coo_matrix((np.array(self.__weights, dtype=np.int32),
+                                       (np.array(self.__sources, dtype=np.int32),
+                                        np.array(self.__targets, dtype=np.int32))),
+                                      shape=(num_nodes, num_nodes)).tocsr()
+        party, party_values = self.__get_codes('party')
+        movement, movement_values = self.__get_codes('movement')
+        arrays = {
+            'screen_names': np.array([node['screen_name'] for node in self.__nodes], dtype=str),
+            'indptr': adjacency.indptr.astype(np.int64),
+            'indices': adjacency.indices.astype(np.int32),
+            'weights': adjacency.data.astype(np.int32),
+            'party': party,
+            'movement': movement,
+            'ff_ratio': np.array([node['ff_ratio'] or 0 for node in self.__nodes], dtype=np.float64),
+            'pbb': np.array([np.nan if node['pbb'] in ('', None) else node['pbb'] for node in self.__nodes],
+                            dtype=np.float64)
+        }
+        return InteractionGraph(arrays, party_values, movement_values)
+
+
 class NetworkAnalyzer:
     __dbm_tweets = None
     __dbm_users = None
     __dbm_networks = None
-    __network = None
+    __dbm_user_edges = None
+    __interaction_graph = None
     __graph = None
-    __nodes = set()
-    __unknown_users = set()
+    __unknown_users = None
     __node_sizes = None
+    BATCH_SIZE = 1000
+    NODE_PROJECTION = {'screen_name': 1, 'party': 1, 'movement': 1, 'ff_ratio': 1, 'friends': 1, 'followers': 1,
+                       'bot_analysis.pbb': 1}
+    NETWORK_PROJECTION = dict(NODE_PROJECTION, interactions=1)
+    USER_EDGES_COLLECTION = 'user_edges'
+    USERS_TOKEN = 'users_db'
+    USER_EDGES_TOKEN = 'user_edges'
+    INTERACTION_TYPES = ['total', 'replies', 'retweets', 'mentions', 'quotes']
+    USERS_PROJECTION = {'flag.partido_politico': 1, 'flag.movimiento': 1, 'tweet_obj.user.id_str': 1,
+                        'tweet_obj.user.screen_name': 1, 'tweet_obj.user.friends_count': 1,
+                        'tweet_obj.user.followers_count': 1, 'tweet_obj.user.verified': 1,
+                        'tweet_obj.retweeted_status.id_str': 1, 'tweet_obj.retweeted_status.user.screen_name': 1,
+                        'tweet_obj.retweeted_status.entities.hashtags.text': 1, 'tweet_obj.quoted_status_id': 1,
+                        'tweet_obj.quoted_status.user.screen_name': 1, 'tweet_obj.in_reply_to_status_id_str': 1,
+                        'tweet_obj.in_reply_to_screen_name': 1, 'tweet_obj.entities.user_mentions.screen_name': 1,
+                        'tweet_obj.entities.hashtags.text': 1}
 
     def __init__(self):
         self.__dbm_tweets = DBManager('tweets')
         self.__dbm_users = DBManager('users')
         self.__dbm_networks = DBManager('networks')
-        self.__network = []
+        self.__dbm_user_edges = DBManager(self.USER_EDGES_COLLECTION)
+        self.__unknown_users = set()
 
     def __computer_ff_ratio(self, friends, followers):
-        if followers > 0 and friends > 0:
-            return friends / followers
-        else:
-            return 0
+        return _compute_ff_ratio(friends, followers)
+
+    def build_user_edges(self):
+        """
+        Build the collection user_edges, which has a record per pair of users that interacted
+        with the number of interactions per type (source, target, total, retweets, replies,
+        mentions, quotes), from the interactions saved in the collection users. The collection
+        is indexed by source and by target, so in and out interactions are indexed lookups.
+        The edges are written to a temporary collection that replaces user_edges once complete,
+        so an interrupted build never leaves a partial user_edges. Once renamed, a marker records
+        the number of tweets from which the users, and therefore the edges, were computed
+        """
+        logging.info('::. Network Analyzer: Building the edges of the interactions between users...')
+        dbm_new_edges = DBManager(self.USER_EDGES_COLLECTION + '_building')
+        dbm_new_edges.clear_collection()
+        # creating the indexes also creates the collection, so it can be renamed even without edges
+        dbm_new_edges.create_index([('target', 1), ('source', 1)])
+        dbm_new_edges.create_index('source')
+        edges_count = 0
+        for users in self.__dbm_users.iterate_by_id({}, self.BATCH_SIZE, {'screen_name': 1, 'interactions': 1}):
+            edges = []
+            for user in users:
+                for interacted_user, interactions in user.get('interactions', {}).items():
+                    edge = {'source': user['screen_name'], 'target': interacted_user}
+                    edge.update(interactions)
+                    edges.append(InsertOne(edge))
+            dbm_new_edges.bulk_write(edges)
+            edges_count += len(edges)
+        dbm_new_edges.rename_collection(self.USER_EDGES_COLLECTION)
+        self.__dbm_user_edges.save_resume_token(
+            self.USER_EDGES_TOKEN, None, num_tweets=self.__dbm_users.get_resume_token(self.USERS_TOKEN, 'num_tweets'))
+        logging.info('::. Network Analyzer: Saved {0} edges'.format(edges_count))
+
+    def __update_users_db(self):
+        # the users, and the edges derived from them, are computed again when tweets were added
+        # or removed since they were built, or when their build didn't complete
+        num_tweets = self.__dbm_tweets.num_records_collection()
+        if self.__dbm_users.get_resume_token(self.USERS_TOKEN, 'num_tweets') != num_tweets:
+            logging.info('::. Network Analyzer: The collection of tweets changed, the users will be updated')
+            self.create_users_db()
+        elif self.__dbm_user_edges.get_resume_token(self.USER_EDGES_TOKEN, 'num_tweets') != num_tweets:
+            self.build_user_edges()
+
+    def __get_user_edges(self, query):
+        self.__update_users_db()
+        return self.__dbm_user_edges.search(query)
+
+    def __summarize_interactions(self, edges, interacted_key):
+        interactions_obj = {}
+        for type_interaction in self.INTERACTION_TYPES:
+            interactions_obj[type_interaction] = {'count': 0, 'details': {}}
+        for edge in edges:
+            for type_interaction in self.INTERACTION_TYPES:
+                if type_interaction in edge.keys():
+                    interactions_obj[type_interaction]['count'] += edge[type_interaction]
+                    interactions_obj[type_interaction]['details'][edge[interacted_key]] = edge[type_interaction]
+        return interactions_obj
+
+    # Get interactions in of the given users
+    def get_in_interactions_of_users(self, user_screen_names):
+        """
+        Get the interactions in which the given users were mentioned, retweeted, quoted, replied
+
+        :param user_screen_names: list of screen names
+        :return: dictionary screen name -> {'in_interactions': {type: {'count', 'details'}}}, where
+        types are total, replies, retweets, mentions and quotes, and details are the number of
+        interactions per user
+        """
+        edges = defaultdict(list)
+        for edge in self.__get_user_edges({'target': {'$in': list(user_screen_names)}}):
+            if edge['source'] != edge['target']:
+                edges[edge['target']].append(edge)
+        return {user_screen_name: {'in_interactions': self.__summarize_interactions(edges[user_screen_name],
+                                                                                    'source')}
+                for user_screen_name in user_screen_names}
+
+    # Get interactions out of the given users
+    def get_out_interactions_of_users(self, user_screen_names):
+        """
+        Get the interactions originated by the given users
+
+        :param user_screen_names: list of screen names
+        :return: dictionary screen name -> {'out_interactions': {type: {'count', 'details'}}}, same
+        structure of get_in_interactions_of_users
+        """
+        edges = defaultdict(list)
+        for edge in self.__get_user_edges({'source': {'$in': list(user_screen_names)}}):
+            edges[edge['source']].append(edge)
+        return {user_screen_name: {'out_interactions': self.__summarize_interactions(edges[user_screen_name],
+                                                                                     'target')}
+                for user_screen_name in user_screen_names}
 
     # Get interactions in of a given users
     def get_in_interactions(self, user_screen_name):
         # compute in interactions, meaning, interactions in which the user
         # was mentioned, retweeted, quoted, replied
-        in_inter_query = {'interactions.' + user_screen_name: {'$exists': 1},
-                          'screen_name': {'$ne': user_screen_name}}
-        n_users = self.__dbm_users.search(in_inter_query)
-        in_interactions_dict, in_rts, in_rps = {}, {}, {}
-        in_qts, in_mts = {}, {}
-        total_in_interactions = 0
-        total_in_retweets, total_in_replies = 0, 0
-        total_in_mentions, total_in_quotes = 0, 0
-        for n_user in n_users:
-            n_user_interactions = n_user['interactions']
-            for i_user, interactions in n_user_interactions.items():
-                if i_user == user_screen_name:
-                    in_interactions_dict[n_user['screen_name']] = interactions['total']
-                    total_in_interactions += interactions['total']
-                    if 'retweets' in interactions.keys():
-                        total_in_retweets += interactions['retweets']
-                        in_rts[n_user['screen_name']] = interactions['retweets']
-                    if 'replies' in interactions.keys():
-                        total_in_replies += interactions['replies']
-                        in_rps[n_user['screen_name']] = interactions['replies']
-                    if 'mentions' in interactions.keys():
-                        total_in_mentions += interactions['mentions']
-                        in_mts[n_user['screen_name']] = interactions['mentions']
-                    if 'quotes' in interactions.keys():
-                        total_in_quotes += interactions['quotes']
-                        in_qts[n_user['screen_name']] = interactions['quotes']
-        in_interactions_obj = {
-            'total': {
-                'count': total_in_interactions,
-                'details': in_interactions_dict
-            },
-            'replies': {
-                'count': total_in_replies,
-                'details': in_rps
-            },
-            'retweets': {
-                'count': total_in_retweets,
-                'details': in_rts
-            },
-            'mentions': {
-                'count': total_in_mentions,
-                'details': in_mts
-            },
-            'quotes': {
-                'count': total_in_quotes,
-                'details': in_qts
-            }
-        }
-        user_dict = {
-            'in_interactions': in_interactions_obj
-        }
-        return user_dict
+        return self.get_in_interactions_of_users([user_screen_name])[user_screen_name]
 
     # Get interactions out of a given users
     def get_out_interactions(self, user_screen_name):
-        user = self.__dbm_users.search({'screen_name': user_screen_name})[0]
         # compute out interactions, meaning, interactions originated by
         # the user
-        user_interactions = user['interactions']
-        out_interactions_dict, out_rts = {}, {}
-        out_rps, out_qts, out_mts = {}, {}, {}
-        total_out_interactions, total_out_retweets = 0, 0
-        total_out_mentions, total_out_replies = 0, 0
-        total_out_quotes = 0
-        for recipient, interactions in user_interactions.items():
-            out_interactions_dict[recipient] = interactions['total']
-            total_out_interactions += interactions['total']
-            if 'retweets' in interactions:
-                total_out_retweets += interactions['retweets']
-                out_rts[recipient] = interactions['retweets']
-            if 'replies' in interactions:
-                total_out_replies += interactions['replies']
-                out_rps[recipient] = interactions['replies']
-            if 'mentions' in interactions:
-                total_out_mentions += interactions['mentions']
-                out_mts[recipient] = interactions['mentions']
-            if 'quotes' in interactions:
-                total_out_quotes += interactions['quotes']
-                out_qts[recipient] = interactions['quotes']
-        out_interactions_obj = {
-            'total': {
-                'count': total_out_interactions,
-                'details': out_interactions_dict
-            },
-            'replies': {
-                'count': total_out_replies,
-                'details': out_rps
-            },
-            'retweets': {
-                'count': total_out_retweets,
-                'details': out_rts
-            },
-            'mentions': {
-                'count': total_out_mentions,
-                'details': out_mts
-            },
-            'quotes': {
-                'count': total_out_quotes,
-                'details': out_qts
-            }
-        }
-        # compile all information in a dictionary
-        user_dict = {
-            'out_interactions': out_interactions_obj
-        }
-        return user_dict
+        return self.get_out_interactions_of_users([user_screen_name])[user_screen_name]
+
+    def __get_interaction_in_tweet(self, tweet_obj):
+        # type of interaction and interacted users of a tweet, classified as in
+        # DBManager.get_unique_users, mentions are only considered in tweets
+        # that are not retweets, quotes or replies
+        if 'retweeted_status' in tweet_obj.keys():
+            return 'retweets', [tweet_obj['retweeted_status']['user']['screen_name']]
+        elif 'quoted_status_id' in tweet_obj.keys():
+            return 'quotes', [tweet_obj.get('quoted_status', {}).get('user', {}).get('screen_name')]
+        elif tweet_obj.get('in_reply_to_status_id_str') or tweet_obj.get('in_reply_to_screen_name'):
+            return 'replies', [tweet_obj.get('in_reply_to_screen_name')]
+        else:
+            mentions = tweet_obj.get('entities', {}).get('user_mentions', [])
+            return 'mentions', [mention['screen_name'] for mention in mentions]
+
+    def __get_users_tables(self, upp):
+        """
+        Compute, in a single pass over the relevant tweets, the attributes of the authors
+        that are saved in the database of users
+
+        :param upp: instance of UserPoliticalPreference used to count the votes of
+        the hashtags of tweets for parties and movements
+        :return: dictionary id of user -> dictionary with the attributes of the user
+        """
+        users = {}
+        tweet_counter, start = 0, time.time()
+        for tweets in self.__dbm_tweets.iterate_by_id({'relevante': 1}, self.BATCH_SIZE, self.USERS_PROJECTION):
+            for tweet in tweets:
+                tweet_obj = tweet['tweet_obj']
+                author = tweet_obj['user']
+                if author['id_str'] not in users:
+                    users[author['id_str']] = {
+                        'screen_name': author['screen_name'],
+                        'friends': author.get('friends_count'),
+                        'followers': author.get('followers_count'),
+                        'verified': author.get('verified'),
+                        'tweets_count': 0,
+                        'counts': defaultdict(int),
+                        'interactions': defaultdict(lambda: defaultdict(int)),
+                        'flag_parties': defaultdict(int),
+                        'flag_movements': defaultdict(int),
+                        'party_votes': defaultdict(int),
+                        'movement_votes': defaultdict(int)
+                    }
+                user = users[author['id_str']]
+                user['tweets_count'] += 1
+                type_interaction, interacted_users = self.__get_interaction_in_tweet(tweet_obj)
+                if type_interaction != 'mentions':
+                    user['counts'][type_interaction] += 1
+                for interacted_user in interacted_users:
+                    if interacted_user:
+                        user['interactions'][interacted_user][type_interaction] += 1
+                        user['interactions'][interacted_user]['total'] += 1
+                flags = tweet.get('flag', {})
+                for party, flag in (flags.get('partido_politico') or {}).items():
+                    if party != '' and flag > 0:
+                        user['flag_parties'][party] += 1
+                for movement, flag in (flags.get('movimiento') or {}).items():
+                    if movement != '' and flag > 0:
+                        user['flag_movements'][movement] += 1
+                upp.count_votes(tweet_obj, user['party_votes'], user['movement_votes'])
+            tweet_counter += len(tweets)
+            logging.info('::. Network Analyzer: Processed {0} tweets ({1:.1f} tweets/s)...'
+                         .format(tweet_counter, tweet_counter / max(time.time() - start, 1e-6)))
+        return users
 
     def create_users_db(self, clear_collection=False):
         logging.info('::. Network Analyzer: Creating database of users, it can take several minutes, please wait_')
+        # an interrupted update leaves the users without marker, so they are updated again
+        self.__dbm_users.clear_resume_token(self.USERS_TOKEN)
         if clear_collection:
             self.__dbm_users.clear_collection()
-        users = self.__dbm_tweets.get_unique_users()
+        self.__dbm_users.create_index('screen_name')
+        # tweets counted before reading them, so tweets added meanwhile make the users outdated
+        num_tweets = self.__dbm_tweets.num_records_collection()
+        upp = UserPoliticalPreference()
+        users = self.__get_users_tables(upp)
         users_count = len(users)
         logging.info('::. Network Analyzer: Extracted {0} unique users from the database...'.format(users_count))
-        progress = 1
-        for user in users:
+        progress, start = 0, time.time()
+        updates = []
+        for user in users.values():
+            counts = user['counts']
             db_user = {
                 'screen_name': user['screen_name'],
                 'friends': user['friends'],
                 'followers': user['followers'],
                 'ff_ratio': self.__computer_ff_ratio(user['friends'], user['followers']),
-                'interactions': user['interactions'],
+                'interactions': {interacted_user: dict(interactions)
+                                 for interacted_user, interactions in user['interactions'].items()},
                 'tweets': user['tweets_count'],
-                'original_tweets': user['original_count'],
-                'rts': user['retweets_count'],
-                'qts': user['quotes_count'],
-                'rps': user['replies_count'],
+                'original_tweets': user['tweets_count'] - (counts['retweets'] + counts['quotes'] +
+                                                           counts['replies']),
+                'rts': counts['retweets'],
+                'qts': counts['quotes'],
+                'rps': counts['replies'],
                 'verified': user['verified']
-
             }
             # Assign the party and movement to the party and movement that are more related to the user
             # counting both Hashtags and Mentions by the user
-            user_parties = self.__dbm_tweets.get_party_user(user['screen_name'])
-            user_parties_count = len(user_parties) or 0
-            logging.debug('::. Network Analyzer: User {0} has {1} associated parties...'
-                          .format(user['screen_name'],user_parties_count))
-
-            if user_parties_count > 0:
-                user_party = user_parties[0]
-                db_user.update({'most_interacted_party': user_party['partido']})
-                user_movements = self.__dbm_tweets.get_movement_user(user['screen_name'])
-                user_movements_count = len(user_movements) or 0
-                logging.debug('::. Network Analyzer: User {0} has {1} associated movements...'
-                              .format(user['screen_name'], user_movements_count))
-                if user_movements_count > 0:
-                    user_movement = user_movements[0]
-                    db_user.update({'most_interacted_movement': user_movement['movimiento']})
-                else:
-                    db_user.update({'most_interacted_movement': ''})
-            else:
-                db_user.update({'most_interacted_party': '', 'movement': ''})
+            most_interacted_party = upp.get_most_voted(user['flag_parties'])
+            most_interacted_movement = upp.get_most_voted(user['flag_movements']) if most_interacted_party else None
+            db_user.update({'most_interacted_party': most_interacted_party or '',
+                            'most_interacted_movement': most_interacted_movement or ''})
+            # Assign the party and movement to the party and movement that are more related to the user
+            # counting the Hashtags used by the user
+            db_user.update({'party': upp.get_most_voted(user['party_votes']),
+                            'movement': upp.get_most_voted(user['movement_votes'])})
+            updates.append(UpdateOne({'screen_name': user['screen_name']}, {'$set': db_user}, upsert=True))
+            if len(updates) == self.BATCH_SIZE:
+                progress += len(updates)
+                self.__dbm_users.bulk_write(updates)
+                updates = []
+                logging.info('::. Network Analyzer: Saved {0}/{1} users ({2:.1f} users/s)...'
+                             .format(progress, users_count, progress / max(time.time() - start, 1e-6)))
+        if updates:
+            progress += len(updates)
+            self.__dbm_users.bulk_write(updates)
+        logging.info('::. Network Analyzer: Saved {0}/{1} users ({2:.1f} users/s)'
+                     .format(progress, users_count, progress / max(time.time() - start, 1e-6)))
+        self.__dbm_users.save_resume_token(self.USERS_TOKEN, None, num_tweets=num_tweets)
+        # the edges are derived from the interactions of users
+        self.build_user_edges()
 
+    def __load_node_table(self):
+        # attributes of all the users as nodes of the network, loaded with a single projected scan
+        node_table = {}
+        for users in self.__dbm_users.iterate_by_id({}, self.BATCH_SIZE, self.NODE_PROJECTION):
+            for user in users:
+                node_table[user['screen_name']] = _get_node(user)
+        logging.info('Loaded {0} users as nodes of the network'.format(len(node_table)))
+        return node_table
 
-            # Assign the party and movement to the party and movement that are more related to the user
-            # counting both Hashtags and Mentions by the user
-            upp = UserPoliticalPreference()
-            user_party = upp.get_user_political_party(user['screen_name'])
-            user_movement = upp.get_user_political_movement(user['screen_name'])
-            db_user.update({'party': user_party, 'movement': user_movement})
-
-            filter_query = {'screen_name': user['screen_name']}
-            logging.debug('::. Network Analyzer: Updating/creating user {0} ({1}/{2})...'
-                          .format(user['screen_name'], progress, users_count))
-            progress += 1
-            self.__dbm_users.update_record(filter_query, db_user, create_if_doesnt_exist=True)
-
-    def generate_network(self, subnet_query={}, depth=1, file_name='network', override_net=False):
+    def generate_network(self, subnet_query={}, depth=1, file_name='network', override_net=False, workers=1,
+                         file_format='gexf', compress=False):
+        """
+        Generate the network of interactions among the users that match the subnet query and
+        the users with whom they interacted, and save it in a gexf or graphml file
+
+        :param subnet_query: dictionary with the filter of users
+        :param depth: if greater than 1, interacted users who are not in the db of users
+        are included in the network if their ff_ratio can be obtained from their tweets
+        :param file_name: name of the file, without extension
+        :param override_net: whether to generate the network even if it was already generated
+        :param workers: number of processes among which the users are distributed
+        :param file_format: gexf or graphml
+        :param compress: whether to compress the file with gzip
+        """
+        # networks saved in another format or compression are generated again
         net_query = subnet_query.copy()
-        net_query.update({'depth': depth})
-        ret_net = self.__dbm_networks.search(net_query)
+        net_query.update({'depth': depth, 'file_format': file_format, 'compress': compress})
+        ret_net = list(self.__dbm_networks.search(net_query))
+        if ret_net and not override_net:
+            f_net = ret_net[0]
+            if 'graph_dir' in f_net.keys() and pathlib.Path(f_net['graph_dir']).exists():
+                logging.info('The network was already generated, please find it at {0}'.format(f_net['file_name']))
+                self.load_graph(f_net['graph_dir'])
+                return
+            # networks generated before their arrays were saved can't be loaded
+            logging.info('The arrays of the network {0} are missing, it will be generated again'.format(
+                f_net['file_name']))
         # the net doesn't exist yet, let's create it
-        if ret_net.count() == 0 or override_net:
-            logging.info('Generating the network, it can take several minutes, please wait_')
-            users = self.__dbm_users.search(subnet_query)
-            # for each user generate his/her edges
-            for user in users:
-                if 'ff_ratio' in user.keys():
-                    u_ff_ratio = user['ff_ratio']
-                else:
-                    u_ff_ratio = self.__computer_ff_ratio(user['friends'], user['followers'])
-                pbb_score = user['bot_analysis']['pbb'] if 'bot_analysis' in user.keys() else ''
-                self.__nodes.add(tuple({'screen_name': user['screen_name'], 'party': user['party'],
-                                        'movement': user['movement'], 'ff_ratio': u_ff_ratio,
-                                        'pbb': pbb_score}.items()))
-                for interacted_user, interactions in user['interactions'].items():
-                    iuser = self.__dbm_users.find_record({'screen_name': interacted_user})
-                    if not iuser:
-                        if depth > 1:
-                            iuser_ffratio = self.__get_ffratio(interacted_user)
-                            if not iuser_ffratio:
-                                self.__unknown_users.add(interacted_user)
-                                continue
-                        else:
-                            self.__unknown_users.add(interacted_user)
-                            continue
-                    else:
-                        if 'ff_ratio' in iuser.keys():
-                            i_ff_ratio = iuser['ff_ratio']
-                        else:
-                            i_ff_ratio = self.__computer_ff_ratio(iuser['friends'], iuser['followers'])
-
-                    pbb_iuser_score = user['bot_analysis']['pbb'] if 'bot_analysis' in iuser.keys() else ''
-                    self.__nodes.add(tuple({'screen_name': iuser['screen_name'], 'party': iuser['party'],
-                                            'movement': iuser['movement'], 'ff_ratio': i_ff_ratio,
-
-                                            'pbb': pbb_iuser_score}.items()))
-                    edge = {
-                        'nodeA': {'screen_name': user['screen_name'], 'ff_ratio': u_ff_ratio,
-                                  'party': user['party'], 'movement': user['movement'],
-                                  'pbb': pbb_score},
-                        'nodeB': {'screen_name': interacted_user, 'ff_ratio': i_ff_ratio,
-                                  'party': iuser['party'], 'movement': iuser['movement'],
-                                  'pbb': pbb_iuser_score},
-                        'weight': interactions['total']
-                    }
-                    self.__network.append(edge)
-            logging.info('Created a network of {0} nodes and {1} edges'.format(len(self.__nodes), len(self.__network)))
-            logging.info('Unknown users {0}'.format(len(self.__unknown_users)))
-            # save the net in a gefx file for posterior usage
-            f_name = self.save_network_in_gexf_format(file_name)
-            logging.info('Saved the network in the file {0}'.format(f_name))
-            db_net = {'file_name': str(f_name)}
-            db_net.update(net_query)
-            self.__dbm_networks.save_record(db_net)
+        logging.info('Generating the network, it can take several minutes, please wait_')
+        self.__unknown_users = set()
+        self.__update_users_db()
+        graph_builder = InteractionGraphBuilder()
+        node_table = self.__load_node_table()
+        users_batches = self.__dbm_users.iterate_by_id(subnet_query, self.BATCH_SIZE, self.NETWORK_PROJECTION)
+        if workers > 1:
+            with Pool(workers, initializer=_init_network_worker, initargs=(node_table, depth)) as pool:
+                networks = list(pool.imap_unordered(_get_network_of_users, users_batches))
         else:
-            f_net = ret_net[0]
-            logging.info('The network was already generated, please find it at {0}'.format(f_net['file_name']))
+            _init_network_worker(node_table, depth)
+            networks = [_get_network_of_users(users) for users in users_batches]
+        for nodes, edges, unknown_users in networks:
+            for node in nodes.values():
+                graph_builder.add_node(node)
+            graph_builder.add_edges(edges)
+            self.__unknown_users.update(unknown_users)
+        self.__interaction_graph = graph_builder.build()
+        logging.info('Created a network of {0} nodes and {1} edges'.format(self.__interaction_graph.num_nodes,
+                                                                          self.__interaction_graph.num_edges))
+        logging.info('Unknown users {0}'.format(len(self.__unknown_users)))
+        # save the net in a file for posterior usage and its arrays to be loaded back
+        f_name = self.save_network(file_name, file_format, compress)
+        logging.info('Saved the network in the file {0}'.format(f_name))
+        graph_dir = self.__interaction_graph.save(self.__get_graph_dir(file_name))
+        logging.info('Saved the arrays of the network in the directory {0}'.format(graph_dir))
+        db_net = {'file_name': str(f_name), 'graph_dir': str(graph_dir)}
+        db_net.update(net_query)
+        # the records of the network being replaced are removed so the lookup finds the new one
+        for old_net in ret_net:
+            self.__dbm_networks.remove_record({'_id': old_net['_id']})
+        self.__dbm_networks.save_record(db_net)
+
+    def __get_graph_dir(self, file_name):
+        return pathlib.Path(__file__).parents[2].joinpath('sna', 'graphs', file_name)
+
+    def load_graph(self, graph_dir, mmap_mode='r'):
+        """
+        Load a network saved by generate_network, its arrays are memory-mapped by default
+
+        :param graph_dir: directory of the arrays of the network
+        :param mmap_mode: mode in which the arrays are memory-mapped, None to read them into memory
+        :return: the interaction graph
+        """
+        self.__interaction_graph = InteractionGraph.load(graph_dir, mmap_mode)
+        return self.__interaction_graph
 
     def create_graph(self):
         logging.info('Creating the graph, please wait_')
-        self.__graph = net.DiGraph()
-        ff_ratio = defaultdict(lambda: 0.0)
-        # create a directed graph from the edge data and populate a dictionary
-        # with the friends/followers ratio
-        for edge in self.__network:
-            user = edge['nodeA']['screen_name']
-            interacted_with = edge['nodeB']['screen_name']
-            num_interactions = edge['weight']
-            u_ff_ratio = edge['nodeA']['ff_ratio']
-            self.__graph.add_edge(user, interacted_with, weight=int(num_interactions))
-            ff_ratio[user] = float(u_ff_ratio)
+        if self.__interaction_graph is None:
+            logging.info('There is no network, generate it or load it before creating the graph')
+            self.__graph = net.DiGraph()
+            return
+        # create a directed graph from the edges of the interaction graph, the
+        # friends/followers ratio of the nodes is in interaction_graph.ff_ratio
+        self.__graph = self.__interaction_graph.to_networkx()
         # obtain central node
         # degrees = net.degree(self.__graph)
         # central_node, max_degree = sorted(degrees, key=itemgetter(1))[-1]
@@ -283,10 +756,13 @@ class NetworkAnalyzer:
         return
 
     def get_graph_nodes(self):
-        return len(self.__nodes)
+        return self.__interaction_graph.num_nodes if self.__interaction_graph else 0
 
     def get_graph_edges(self):
-        return len(self.__network)
+        return self.__interaction_graph.num_edges if self.__interaction_graph else 0
+
+    def get_interaction_graph(self):
+        return self.__interaction_graph
 
     def get_graph(self):
         return self.__graph
@@ -294,83 +770,24 @@ class NetworkAnalyzer:
     def get_node_sizes(self):
         return self.__node_sizes
 
-    def __get_ffratio(self, screen_name):
-        query = {
-            '$or': [
-                {'tweet_obj.user.screen_name': screen_name},
-                {'tweet_obj.retweeted_status.user.screen_name': screen_name},
-                {'tweet_obj.quoted_status.user.screen_name': screen_name}
-            ]
-        }
-        tweet_obj = self.__dbm_tweets.find_record(query)
-        if tweet_obj:
-            tweet = tweet_obj['tweet_obj']
-            if 'retweeted_status' in tweet.keys():
-                return self.__computer_ff_ratio(tweet['retweeted_status']['user']['friends_count'],
-                                                tweet['retweeted_status']['user']['followers_count'])
-            elif 'quoted_status' in tweet.keys():
-                return self.__computer_ff_ratio(tweet['quoted_status']['user']['friends_count'],
-                                                tweet['quoted_status']['user']['followers_count'])
-            else:
-                return self.__computer_ff_ratio(tweet['user']['friends_count'],
-                                                tweet['user']['followers_count'])
-        else:
-            return None
+    def save_network(self, file_name, file_format='gexf', compress=False):
+        """
+        Save the network in the directory sna/gefx
 
-    def save_network_in_gexf_format(self, file_name):
-        today = datetime.strftime(datetime.now(), '%m/%d/%y')
-        f_name = pathlib.Path(__file__).parents[2].joinpath('sna', 'gefx', file_name+'.gexf')
-        with open(str(f_name), 'w', encoding='utf-8') as f:
-            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            f.write('<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.1draft/viz" '
-                    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-                    'xsi:schemaLocation="http://www.gexf.net/1.2draft http://www.gexf.net/1.2draft/gexf.xsd" '
-                    'version="1.2">\n')
-            f.write('<meta lastmodifieddate="{0}">\n'.format(today))
-            f.write('<creator>PoliticBots</creator>\n')
-            f.write('<description>{0}</description>\n'.format(file_name))
-            f.write('</meta>\n')
-            f.write('<graph mode="static" defaultedgetype="directed">\n')
-            # add data attributes
-            f.write('<attributes class="node">\n')
-            f.write('<attribute id="0" title="party" type="string"/>\n')
-            f.write('<attribute id="1" title="movement" type="string"/>\n')
-            f.write('<attribute id="2" title="ff_ratio" type="float"/>\n')
-            f.write('<attribute id="3" title="pbb" type="float"/>\n')
-            f.write('</attributes>\n')
-            # add nodes
-            f.write('<nodes>\n')
-            node_id = 0
-            list_nodes = []
-            for node_tup in self.__nodes:
-                node = dict(node_tup)
-                f.write('<node id="{0}" label="{1}">\n'.format(node_id, node['screen_name']))
-                f.write('<attvalues>\n')
-                f.write('<attvalue for="0" value="{0}"/>\n'.format(node['party']))
-                f.write('<attvalue for="1" value="{0}"/>\n'.format(node['movement']))
-                f.write('<attvalue for="2" value="{0}"/>\n'.format(node['ff_ratio']))
-                f.write('<attvalue for="3" value="{0}"/>\n'.format(node['pbb']))
-                f.write('</attvalues>\n')
-                #f.write('<viz:size value="{0}"/>\n'.format(node['ff_ratio']))
-                f.write('</node>\n')
-                node_id += 1
-                list_nodes.append(node['screen_name'])
-            f.write('</nodes>\n')
-            # add edges
-            f.write('<edges>\n')
-            edge_id = 0
-            for edge in list(self.__network):
-                id_vertexA = list_nodes.index(edge['nodeA']['screen_name'])
-                id_vertexB = list_nodes.index(edge['nodeB']['screen_name'])
-                weight = edge['weight']
-                f.write('<edge id="{0}" source="{1}" target="{2}" weight="{3}"/>\n'.format(edge_id, id_vertexA,
-                                                                                           id_vertexB, weight))
-                edge_id += 1
-            f.write('</edges>\n')
-            f.write('</graph>\n')
-            f.write('</gexf>\n')
+        :param file_name: name of the file without extension
+        :param file_format: gexf or graphml
+        :param compress: whether to compress the file with gzip
+        :return: path of the file
+        """
+        writer = NetworkWriter(file_format, compress)
+        f_name = pathlib.Path(__file__).parents[2].joinpath('sna', 'gefx', file_name+writer.get_extension())
+        writer.write(f_name, self.__interaction_graph.get_nodes(), self.__interaction_graph.get_edges(),
+                     description=file_name)
         return f_name
 
+    def save_network_in_gexf_format(self, file_name):
+        return self.save_network(file_name, 'gexf')
+
 #if __name__ == '__main__':
 #    na = NetworkAnalyzer()
 #    na.create_users_db(clear_collection=True)
@@ -0,0 +1,106 @@
+import click
+import logging
+import os
+import pathlib
+import sys
+import time
+
+# Add the directory to the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+from src.analyzer.data_analyzer import SentimentAnalysis
+from src.utils.db_manager import DBManager
+
+logging.basicConfig(filename=str(pathlib.Path(__file__).parents[0].joinpath('politic_bots.log')), level=logging.DEBUG)
+
+
+SENTIMENT_QUERY = {'relevante': 1, 'tweet_obj.retweeted_status': {'$exists': 0}}
+
+
+def read_tweets_by_position(dbm, num_tweets):
+    # the way analyze_sentiments used to read the tweets, every
+    # access by position runs a new query that skips the previous ones
+    tweet_regs = dbm.search(SENTIMENT_QUERY)
+    for current_reg in range(num_tweets):
+        tweet_regs[current_reg]['tweet_obj']['id_str']
+
+
+def read_tweets_streaming(dbm, num_tweets):
+    read_tweets = 0
+    for tweet_regs in dbm.iterate_by_id(SENTIMENT_QUERY, SentimentAnalysis.BATCH_SIZE,
+                                        SentimentAnalysis.SENTIMENT_PROJECTION):
+        read_tweets += len(tweet_regs)
+        if read_tweets >= num_tweets:
+            break
+
+
+def benchmark_sentiment_reading(sizes, include_positional):
+    dbm = DBManager('tweets')
+    readers = [('streaming', read_tweets_streaming)]
+    if include_positional:
+        readers.append(('positional', read_tweets_by_position))
+    tot_tweets = dbm.search(SENTIMENT_QUERY).count()
+    click.echo('Tweets to analyze in the db: {0}'.format(tot_tweets))
+    for size in sizes:
+        size = min(size, tot_tweets)
+        for reader_name, reader in readers:
+            start = time.perf_counter()
+            reader(dbm, size)
+            elapsed = time.perf_counter() - start
+            click.echo('{0:>10} {1:>8} tweets {2:8.2f} s {3:10.1f} tweets/s'.format(reader_name, size, elapsed,
+                                                                                  size / elapsed if elapsed else 0))
+
+
+def benchmark_sentiment_methods(num_tweets):
+    # the cache is not used so the local analyzer really computes the sentiment
+    sa_local = SentimentAnalysis(use_cache=False)
+    sa_lexicon = SentimentAnalysis(use_cache=False, method='lexicon')
+    dbm = DBManager('tweets')
+    tweets = []
+    for tweet_regs in dbm.iterate_by_id(SENTIMENT_QUERY, SentimentAnalysis.BATCH_SIZE,
+                                        SentimentAnalysis.SENTIMENT_PROJECTION):
+        for tweet_reg in tweet_regs:
+            tweet = tweet_reg['tweet_obj']
+            tweets.append({'id': tweet['id_str'], 'text': tweet.get('full_text', tweet.get('text'))})
+        if len(tweets) >= num_tweets:
+            break
+    tweets = tweets[:num_tweets]
+    tones = {}
+    for method_name, analyze in [('local', sa_local.do_sentiment_analysis),
+                                 ('lexicon', sa_lexicon.lexicon_sentiment_analysis)]:
+        start = time.perf_counter()
+        results = []
+        for i in range(0, len(tweets), SentimentAnalysis.BATCH_SIZE):
+            results.extend(analyze(tweets[i:i+SentimentAnalysis.BATCH_SIZE]))
+        elapsed = time.perf_counter() - start
+        tones[method_name] = {result['id']: result['sentimiento']['tono'] for result in results}
+        click.echo('{0:>10} {1:>8} tweets {2:8.2f} s {3:10.1f} tweets/s'.format(method_name, len(tweets), elapsed,
+                                                                              len(tweets) / elapsed if elapsed else 0))
+    common_ids = set(tones['local']) & set(tones['lexicon'])
+    agreements = sum(1 for id_tweet in common_ids if tones['local'][id_tweet] == tones['lexicon'][id_tweet])
+    if common_ids:
+        click.echo('Agreement between methods: {0:.1%} of {1} tweets'.format(agreements / len(common_ids),
+                                                                             len(common_ids)))
+
+
+@click.command()
+@click.option('--sentiment_reading', help='Compare the throughput of reading the tweets whose sentiment is going '
+                                          'to be analyzed by position and by streaming', default=False, is_flag=True)
+@click.option('--sentiment_methods', help='Compare the speed and agreement of the local and lexicon sentiment '
+                                          'analyzers', default=False, is_flag=True)
+@click.option('--sizes', help='Comma-separated numbers of tweets to read', default='1000,2000,4000,8000')
+@click.option('--skip_positional', help='Do not measure the reading by position', default=False, is_flag=True)
+def run_benchmark(sentiment_reading, sentiment_methods, sizes, skip_positional):
+    sizes = [int(size) for size in sizes.split(',')]
+    if sentiment_reading:
+        benchmark_sentiment_reading(sizes, not skip_positional)
+    elif sentiment_methods:
+        benchmark_sentiment_methods(sizes[0])
+    else:
+        raise click.UsageError('Illegal user: Please indicate a benchmark. Type --help for more information of '
+                               'the available options')
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -38,23 +38,23 @@ def do_tweet_collection():
     te.identify_relevant_tweets()
 
 
-def do_sentiment_analysis():
-    sa = SentimentAnalysis()
-    sa.analyze_sentiments(update_sentiment=True)
+def do_sentiment_analysis(workers, method):
+    sa = SentimentAnalysis(method=method)
+    sa.analyze_sentiments(update_sentiment=True, workers=workers)
 
 
-def analyze_tweet_relevance():
+def analyze_tweet_relevance(workers):
     # Label relevant tweets
     logging.info('Instantiating TweetEvaluator...')
     te = TweetEvaluator()
     logging.info('Evaluating the relevance of the new tweets...')
-    te.identify_relevant_tweets()
+    te.identify_relevant_tweets(workers=workers)
 
 
-def build_interaction_net():
+def build_interaction_net(net_format, compress_net):
     # Create database of users
     na = NetworkAnalyzer()
-    na.generate_network()
+    na.generate_network(file_format=net_format, compress=compress_net)
 
 
 def create_db_users():
@@ -69,15 +69,22 @@ def create_db_users():
 @click.option('--interaction_net', help='Generate the interaction network', default=False, is_flag=True)
 @click.option('--flag_tweets', help='Identify and flag relevant tweets', default=False, is_flag=True)
 @click.option('--db_users', help='Create a database of users', default=False, is_flag=True)
-def run_task(collect_tweets, sentiment_analysis, interaction_net, flag_tweets, db_users):
+@click.option('--sentiment_method', help='Method used by --sentiment_analysis', default='local',
+              type=click.Choice(['local', 'remote', 'lexicon']))
+@click.option('--net_format', help='Format of the file of --interaction_net', default='gexf',
+              type=click.Choice(['gexf', 'graphml']))
+@click.option('--compress_net', help='Compress the file of --interaction_net with gzip', default=False, is_flag=True)
+@click.option('--workers', help='Number of worker processes used by --flag_tweets and --sentiment_analysis', default=1, type=int)
+def run_task(collect_tweets, sentiment_analysis, interaction_net, flag_tweets, db_users, sentiment_method, net_format,
+             compress_net, workers):
     if collect_tweets:
         do_tweet_collection()
     elif sentiment_analysis:
-        do_sentiment_analysis()
+        do_sentiment_analysis(workers, sentiment_method)
     elif flag_tweets:
-        analyze_tweet_relevance()
+        analyze_tweet_relevance(workers)
     elif interaction_net:
-        build_interaction_net()
+        build_interaction_net(net_format, compress_net)
     elif db_users:
         create_db_users()
     else:
@@ -1,15 +1,20 @@
+from array import array
 from collections import defaultdict
 from datetime import datetime
 from src.utils.db_manager import DBManager
-from src.utils.utils import get_user_handlers_and_hashtags, parse_metadata, get_config, get_py_date, clean_emojis, get_video_config_with_user_bearer
+from src.utils.utils import KeywordMatcher, parse_metadata, get_config, get_py_dates, clean_emojis
 from src.tweet_collector.add_flags import add_values_to_flags, get_entities_tweet, create_flag
-from math import ceil
-from selenium import webdriver
+from multiprocessing import Pool
+from pymongo import UpdateOne, UpdateMany
+from scipy import sparse
+from concurrent.futures import ThreadPoolExecutor
 
+import asyncio
 import csv
+import http.client
 import logging
+import numpy as np
 import pathlib
-import re
 import calendar
 import time
 
@@ -18,13 +23,19 @@ logging.basicConfig(filename=str(pathlib.Path.cwd().joinpath('politic_bots.log')
 
 
 class TweetEvaluator:
-    special_chars = r'[=\+/&<>;:\'\"\?%$!¡\,\. \t\r\n]+'
     hashtags, user_handlers = [], []
+    matcher = None
     __dbm = None
     BATCH_SIZE = 1000
+    RANGES_PER_WORKER = 4
+    RELEVANCE_PROJECTION = {
+        'tweet_obj.id_str': 1, 'tweet_obj.user.screen_name': 1, 'tweet_obj.entities': 1,
+        'tweet_obj.text': 1, 'tweet_obj.full_text': 1
+    }
 
     def __init__(self):
-        self.user_handlers, self.hashtags = get_user_handlers_and_hashtags()
+        self.matcher = KeywordMatcher()
+        self.user_handlers, self.hashtags = self.matcher.user_handlers, self.matcher.hashtags
         self.__dbm = DBManager('tweets')
 
     def __is_relevant(self, users_counter, hashtags_counter):
@@ -38,14 +49,7 @@ class TweetEvaluator:
             return False
 
     def __assess_tweet_by_text(self, tweet_text):
-        tweet_text = re.sub(u'\u2026', '', tweet_text)  # remove ellipsis unicode char
-        users_counter, hashtags_counter = 0, 0
-        for token in tweet_text.split():
-            token = re.sub(self.special_chars, '', token)  # remove special chars
-            if token.lower() in self.user_handlers:
-                users_counter += 1
-            if token.lower() in self.hashtags:
-                hashtags_counter += 1
+        users_counter, hashtags_counter = self.matcher.count_keywords(tweet_text)
         return self.__is_relevant(users_counter, hashtags_counter)
 
     def __assess_tweet_by_entities(self, tweet_hashtags, tweet_mentions):
@@ -80,66 +84,74 @@ class TweetEvaluator:
                 else:
                     return self.__assess_tweet_by_text(tweet['text'])
 
-    def __mark_relevance_rt(self, tweet_reg):
-        logging.info('Marking RTS...')
-        query = {
-            'tweet_obj.retweeted_status': {'$exists': 1},
-            'tweet_obj.retweeted_status.id_str': {'$eq': tweet_reg['tweet_obj']['id_str']},
-            'relevante': {'$ne': tweet_reg['relevante']}
-        }
-        update = {
-            '$set':{
-                'relevante': tweet_reg['relevante']
-            }
-        }
-        update_res = self.__dbm.update_record_many(query,update)
-        logging.info('Marked {0} RTS...'.format(update_res.matched_count))
-
-    def identify_relevant_tweets(self):
+    def __get_relevance_updates(self, tweets):
+        updates = []
+        num_relevant = 0
+        for tweet_reg in tweets:
+            tweet = tweet_reg['tweet_obj']
+            relevance = 1 if self.is_tweet_relevant(tweet) else 0
+            num_relevant += relevance
+            updates.append(UpdateOne({'_id': tweet_reg['_id']}, {'$set': {'relevante': relevance}}))
+            # copy the relevance flag to rts
+            updates.append(UpdateMany({'tweet_obj.retweeted_status.id_str': tweet['id_str'],
+                                       'relevante': {'$ne': relevance}},
+                                      {'$set': {'relevante': relevance}}))
+        return updates, num_relevant
+
+    def identify_relevant_tweets_in_range(self, query, lower_id=None, upper_id=None, resume_name=None):
+        """
+        Flag the relevance of the tweets that match the query and whose _id is in the range
+        [lower_id, upper_id), the flags of a batch are written with a single bulk operation
+
+        :return: tuple with the number of processed tweets and the number of relevant tweets
+        """
+        num_tweets, num_relevant = 0, 0
+        for tweets in self.__dbm.iterate_by_id(query, self.BATCH_SIZE, self.RELEVANCE_PROJECTION, resume_name,
+                                               lower_id, upper_id):
+            updates, batch_relevant = self.__get_relevance_updates(tweets)
+            self.__dbm.bulk_write(updates)
+            num_tweets += len(tweets)
+            num_relevant += batch_relevant
+            logging.info('Flagged a batch of {0} tweets, {1} of them are relevant'.format(len(tweets),
+                                                                                      batch_relevant))
+        return num_tweets, num_relevant
+
+    def identify_relevant_tweets(self, resume=True, workers=1):
+        """
+        Flag as relevant (relevante=1) or irrelevant (relevante=0) the original tweets
+        that haven't been evaluated yet and copy the flag to their retweets
+
+        :param resume: continue after the last batch processed by a previous, interrupted run
+        (only in sequential mode, in parallel mode the pending tweets are split again on every run)
+        :param workers: number of processes that evaluate the tweets, each of them takes care of
+        a range of _id of the pending tweets
+        """
         # select only original tweets that are not marked as relevant
         query = {
             'relevante': {'$exists': 0},
             'tweet_obj.retweeted_status': {'$exists': 0}
         }
         logging.info('Relevant Tweets: Running query to count...')
-        # processing by batch as workaround cursor not found error
         total_tweets = self.__dbm.search(query, only_relevant_tws=False).count()
-        total_batches = ceil(total_tweets/self.BATCH_SIZE)
-        batch = 1
-        moreToProcess = batch<=total_batches
-
-        while moreToProcess:
-            logging.info('Querying records in batches of {0} records...'.format(self.BATCH_SIZE))
-            search_res = self.__dbm.search(query, only_relevant_tws=False).limit(self.BATCH_SIZE)
-            logging.info('Loading batch {0}/{1} into memory...'.format(batch, total_batches))
-            tweets = [doc for doc in search_res]
-            total_tweets_batch = self.BATCH_SIZE
-            if batch == total_batches:
-                total_tweets_batch = len(tweets)
-            logging.info('Identifying relevant tweets in batch {0}/{1} out of {2} tweets...'.format(batch, total_batches, total_tweets_batch))
-            tweet_counter = 0
-            try:
-                for tweet_reg in tweets:
-                    tweet_counter += 1
-                    tweet = tweet_reg['tweet_obj']
-                    if self.is_tweet_relevant(tweet):
-                        tweet_reg['relevante'] = 1
-                        logging.info('Identifying {0}/{1} tweets (relevant)'.format(tweet_counter, total_tweets))
-                    else:
-                        tweet_reg['relevante'] = 0
-                        logging.info('Identifying {0}/{1} tweets (irrelevant)'.format(tweet_counter, total_tweets))
-                    self.__dbm.update_record({'tweet_obj.id_str': tweet['id_str']},tweet_reg)
-                    # copy the relevance flag to rts
-                    self.__mark_relevance_rt(tweet_reg)
-
-                logging.info('Finished identifying relevant tweets in batch {0}/{1} out of {2} tweets...'.format(batch, total_batches, total_tweets_batch))
-                batch+=1
-                moreToProcess = batch<=total_batches
-            except Exception as e:
-                logging.info("Exception occurred...")
-                logging.info("Exception message {0}".format(e))
-
-        logging.info('Finished identifying relevant tweets...')
+        logging.info('Identifying relevant tweets among {0} tweets...'.format(total_tweets))
+        num_tweets, num_relevant = 0, 0
+        if workers > 1:
+            # split the pending tweets in more ranges than workers to balance the load
+            id_ranges = self.__dbm.get_id_ranges(query, workers * self.RANGES_PER_WORKER)
+            tasks = [(query, lower_id, upper_id) for lower_id, upper_id in id_ranges]
+            logging.info('Distributing {0} ranges of tweets among {1} workers...'.format(len(tasks), workers))
+            with Pool(workers, initializer=_init_relevance_worker) as pool:
+                for range_tweets, range_relevant in pool.imap_unordered(_identify_relevant_tweets_in_range, tasks):
+                    num_tweets += range_tweets
+                    num_relevant += range_relevant
+                    logging.info('Identified {0}/{1} tweets'.format(num_tweets, total_tweets))
+        else:
+            # processing by batches paginated on _id as workaround cursor not found error,
+            # the last processed batch is recorded so an interrupted run can be resumed
+            resume_name = 'identify_relevant_tweets' if resume else None
+            num_tweets, num_relevant = self.identify_relevant_tweets_in_range(query, resume_name=resume_name)
+        logging.info('Finished identifying relevant tweets, {0} out of {1} are relevant...'.format(num_relevant,
+                                                                                               num_tweets))
         return True
 
     # set to 'user' the type of tweets which keyword contains @
@@ -166,44 +178,58 @@ class TweetEvaluator:
             scs.append('@'+sc['screen_name'])
         return scs
 
-    # fix value of candidatura if hashtags related to a candidacy
-    # are present in the text of the tweet
-    def fix_value_of_candidatura(self):
+    def __index_candidacies(self):
+        """
+        Index the keywords related to candidacies by the party and movement of their candidates.
+        A tweet without movement may refer to any movement of its party, so the keywords are
+        also indexed under (party, ''). The position of the keyword in the metadata file is
+        kept to resolve tweets that match several keywords as the file order dictates
+
+        :return: dictionary (party, movement) -> {'keywords': {keyword: (position, candidacy)},
+                                                  'rows': [(keyword, candidacy)]}
+        """
         script_parent_dir = pathlib.Path(__file__).parents[1]
         config_fn = script_parent_dir.joinpath('config.json')
         configuration = get_config(config_fn)
         keyword, k_metadata = parse_metadata(configuration['metadata'])
-        interested_data = []
-        # keep metadata that refer to candidacies
-        for kword, kmetada in zip(keyword, k_metadata):
-            if kmetada['candidatura'] != '':
-                kmetada.update({'keyword': kword})
-                interested_data.append(kmetada)
+        candidacies = defaultdict(lambda: {'keywords': {}, 'rows': []})
+        for position, (kword, kmetadata) in enumerate(zip(keyword, k_metadata)):
+            # keep metadata that refer to candidacies
+            if kmetadata['candidatura'] == '':
+                continue
+            movement = kmetadata.get('movimiento', '')
+            keys = {(kmetadata['partido_politico'], movement), (kmetadata['partido_politico'], '')}
+            for key in keys:
+                candidacies[key]['keywords'].setdefault(kword, (position, kmetadata['candidatura']))
+                candidacies[key]['rows'].append((kword, kmetadata['candidatura']))
+        return candidacies
+
+    # fix value of candidatura if hashtags related to a candidacy
+    # are present in the text of the tweet
+    def fix_value_of_candidatura(self):
+        candidacies = self.__index_candidacies()
+        # select tweets without candidacy
         query = {
-            'candidatura': ''
+            'candidatura': '',
+            'relevante': 1
         }
-        # select tweets without candidacy
-        s_objs = self.__dbm.search(query)
+        projection = {'partido_politico': 1, 'movimiento': 1, 'tweet_obj.entities': 1, 'tweet_obj.text': 1,
+                      'tweet_obj.full_text': 1, 'tweet_obj.retweeted_status.id_str': 1,
+                      'tweet_obj.retweeted_status.entities': 1, 'tweet_obj.retweeted_status.full_text': 1}
         num_fixed_tweets = 0
         # iterate over tweets without candidacy and fix those
         # whose text mention a candidate or have hashtags
         # related to a candidacy
-        for s_obj in s_objs:
-            party = s_obj['partido_politico']
-            movement = s_obj['movimiento']
-            tweet = s_obj['tweet_obj']
-            relevant_data = []
-            candidacy = ''
-            # keep metadata related to the political party
-            # (and movement) of the tweet (s_obj)
-            for ida in interested_data:
-                if ida['partido_politico'] == party:
-                    if movement != '':
-                        if ida['movimiento'] == movement:
-                            relevant_data.append(ida)
-                    else:
-                        relevant_data.append(ida)
-            if len(relevant_data) > 0:
+        for s_objs in self.__dbm.iterate_by_id(query, self.BATCH_SIZE, projection):
+            updates = []
+            for s_obj in s_objs:
+                # keep metadata related to the political party
+                # (and movement) of the tweet (s_obj)
+                relevant_data = candidacies.get((s_obj.get('partido_politico'), s_obj.get('movimiento', '')))
+                if not relevant_data:
+                    continue
+                tweet = s_obj['tweet_obj']
+                candidacy = ''
                 # extract relevant information of the tweet. hashtags and mentions if
                 # the tweet obj has these entities otherwise the text of the tweet
                 if 'retweeted_status' in tweet.keys():
@@ -213,50 +239,78 @@ class TweetEvaluator:
                 if 'entities' in original_tweet.keys():
                     t_user_mentions = self.__get_screen_names(original_tweet['entities']['user_mentions'])
                     t_hashtags = self.__get_hashtags(original_tweet['entities']['hashtags'])
-                    # see if the interested keywords are part of the tweet hashtags or mentions
-                    for rd in relevant_data:
-                        if rd['keyword'] in t_user_mentions:
-                            candidacy = rd['candidatura']
-                            break
-                        else:
-                            if rd['keyword'] in t_hashtags:
-                                candidacy = rd['candidatura']
-                                break
+                    # see if the interested keywords are part of the tweet hashtags or mentions,
+                    # the first keyword of the metadata file wins
+                    matches = [relevant_data['keywords'][entity] for entity in t_user_mentions + t_hashtags
+                               if entity in relevant_data['keywords']]
+                    if matches:
+                        candidacy = min(matches)[1]
                 else:
                     if 'full_text' in original_tweet.keys():
                         t_text = tweet['full_text']
                     else:
                         t_text = tweet['text']
                     # see if the interested keywords are present in the text
-                    for rd in relevant_data:
-                        if rd['keyword'] in t_text:
-                            candidacy = rd['candidatura']
+                    for kword, kcandidacy in relevant_data['rows']:
+                        if kword in t_text:
+                            candidacy = kcandidacy
                             break
                 # fix candidacy key
                 if candidacy:
-                    s_obj['candidatura'] = candidacy
-                    num_fixed_tweets += 1
-                    self.__dbm.save_record(s_obj)
+                    updates.append(UpdateOne({'_id': s_obj['_id']}, {'$set': {'candidatura': candidacy}}))
+            self.__dbm.bulk_write(updates)
+            num_fixed_tweets += len(updates)
         return num_fixed_tweets
 
 
+# Evaluator of the worker processes, it is created once per process
+# so every worker has its own connection to the database
+_relevance_evaluator = None
+
+
+def _init_relevance_worker():
+    global _relevance_evaluator
+    _relevance_evaluator = TweetEvaluator()
+
+
+def _identify_relevant_tweets_in_range(task):
+    query, lower_id, upper_id = task
+    return _relevance_evaluator.identify_relevant_tweets_in_range(query, lower_id, upper_id)
+
+
 class HashtagDiscoverer:
     user_handlers, hashtags = [], []
+    matcher = None
     __dbm = None
+    __dbm_hashtags = None
+    __dbm_cooccurrences = None
+    BATCH_SIZE = 1000
+    RANGES_PER_WORKER = 4
+    COUNTERS_TOKEN = 'hashtag_counters'
+    # saved while the counters are being written, found at startup only if an update was interrupted
+    COUNTERS_IN_PROGRESS_TOKEN = 'hashtag_counters_in_progress'
+    # tweets whose hashtags can be read from the entities (of the original tweet in case of retweets)
+    ENTITIES_FILTER = {
+        '$or': [{'tweet_obj.retweeted_status': {'$exists': 0}, 'tweet_obj.entities': {'$exists': 1}},
+                {'tweet_obj.retweeted_status.entities': {'$exists': 1}}]
+    }
+    # tweets whose hashtags have to be extracted from the text
+    TEXT_ONLY_FILTER = {
+        '$or': [{'tweet_obj.retweeted_status': {'$exists': 0}, 'tweet_obj.entities': {'$exists': 0}},
+                {'tweet_obj.retweeted_status': {'$exists': 1},
+                 'tweet_obj.retweeted_status.entities': {'$exists': 0}}]
+    }
+    TEXT_PROJECTION = {'tweet_obj.text': 1, 'tweet_obj.full_text': 1}
 
     def __init__(self):
-        self.user_handlers, self.hashtags = get_user_handlers_and_hashtags()
+        self.matcher = KeywordMatcher()
+        self.user_handlers, self.hashtags = self.matcher.user_handlers, self.matcher.hashtags
         self.__dbm = DBManager('tweets')
+        self.__dbm_hashtags = DBManager('hashtag_counters')
+        self.__dbm_cooccurrences = DBManager('hashtag_cooccurrence_counters')
 
     def discover_hashtags_by_text(self, tweet_text):
-        new_hashtags = set()
-        for token in tweet_text.split():
-            if u'\u2026' in token:
-                continue
-            if '#' in token:
-                if token.lower() not in self.hashtags:
-                    new_hashtags.add(token)
-        return new_hashtags
+        return {token for token, is_known in self.matcher.get_hashtag_tokens(tweet_text) if not is_known}
 
     def discover_hashtags_by_entities(self, tweet_hashtags):
         new_hashtags = set()
@@ -268,41 +322,178 @@ class HashtagDiscoverer:
                 new_hashtags.add('#' + tweet_hashtag['text'])
         return new_hashtags
 
-    def discover_new_hashtags(self, query={}, sorted_results=True):
-        tweet_regs = self.__dbm.search(query)
-        new_hashtags = defaultdict(int)
-        for tweet_reg in tweet_regs:
-            tweet = tweet_reg['tweet_obj']
-            if 'retweeted_status' in tweet.keys():
-                original_tweet = tweet['retweeted_status']
-            else:
-                original_tweet = tweet
-            if 'entities' in original_tweet.keys():
-                t_hashtags = original_tweet['entities']['hashtags']
-                discovered_hashtags = self.discover_hashtags_by_entities(t_hashtags)
-            else:
-                if 'full_text' in original_tweet.keys():
-                    tweet_text = tweet['full_text']
-                else:
-                    tweet_text = tweet['text']
-                discovered_hashtags = self.discover_hashtags_by_text(tweet_text)
-            for discovered_hashtag in discovered_hashtags:
-                new_hashtags[discovered_hashtag] += 1
+    def count_hashtags_by_text_in_range(self, match, lower_id=None, upper_id=None):
+        """
+        Count the hashtags and the combinations of known hashtags that appear in the text of
+        the tweets that match the query and whose _id is in the range [lower_id, upper_id)
+
+        :return: tuple of two dictionaries, the number of tweets per hashtag and the number of
+        tweets per combination of known hashtags
+        """
+        hashtags_count, cooccurrences_count = defaultdict(int), defaultdict(int)
+        for tweet_regs in self.__dbm.iterate_by_id(match, self.BATCH_SIZE, self.TEXT_PROJECTION,
+                                                   lower_id=lower_id, upper_id=upper_id):
+            for tweet_reg in tweet_regs:
+                tweet = tweet_reg['tweet_obj']
+                tweet_text = tweet['full_text'] if 'full_text' in tweet.keys() else tweet['text']
+                hashtag_tokens = self.matcher.get_hashtag_tokens(tweet_text)
+                for hashtag in {token for token, _ in hashtag_tokens}:
+                    hashtags_count[hashtag] += 1
+                known_hashtags = {token for token, is_known in hashtag_tokens if is_known}
+                if known_hashtags:
+                    cooccurrences_count[' '.join(sorted(known_hashtags))] += 1
+        return hashtags_count, cooccurrences_count
+
+    def __count_hashtags_by_text(self, match, workers):
+        if workers > 1:
+            id_ranges = self.__dbm.get_id_ranges(match, workers * self.RANGES_PER_WORKER)
+            tasks = [(match, lower_id, upper_id) for lower_id, upper_id in id_ranges]
+            hashtags_count, cooccurrences_count = defaultdict(int), defaultdict(int)
+            with Pool(workers, initializer=_init_hashtag_worker) as pool:
+                for range_hashtags, range_cooccurrences in pool.imap_unordered(_count_hashtags_by_text_in_range,
+                                                                               tasks):
+                    for hashtag, count in range_hashtags.items():
+                        hashtags_count[hashtag] += count
+                    for cooccurrence, count in range_cooccurrences.items():
+                        cooccurrences_count[cooccurrence] += count
+            return hashtags_count, cooccurrences_count
+        else:
+            return self.count_hashtags_by_text_in_range(match)
+
+    def __count_hashtags(self, match, workers=1):
+        # tweets with entities are counted by the database, the (few) tweets
+        # without entities are counted here by scanning their texts
+        entities_match = {'$and': [match, self.ENTITIES_FILTER]}
+        text_match = {'$and': [match, self.TEXT_ONLY_FILTER]}
+        hashtags_count, cooccurrences_count = self.__count_hashtags_by_text(text_match, workers)
+        for doc in self.__dbm.get_hashtags_count(entities_match):
+            hashtags_count[doc['_id']] += doc['count']
+        for doc in self.__dbm.get_hashtags_cooccurrence(entities_match, list(self.hashtags)):
+            cooccurrences_count[' '.join(doc['_id'])] += doc['count']
+        return hashtags_count, cooccurrences_count
+
+    def __count_relevant_tweets_until(self, last_id):
+        return self.__dbm.search({'relevante': 1, '_id': {'$lte': last_id}}, only_relevant_tws=False).count()
+
+    def update_hashtag_counters(self, rebuild=False, workers=1):
+        """
+        Update the counters of hashtags and combinations of known hashtags (collections
+        hashtag_counters and hashtag_cooccurrence_counters) with the relevant tweets added
+        since the last update. Only the tweets stored before the first original tweet whose
+        relevance hasn't been evaluated yet are counted, the rest are left for the next update.
+        The counters are rebuilt if the number of relevant tweets already counted has changed,
+        e.g., because retweets were flagged after their original or the flags were re-evaluated
+
+        :param rebuild: discard the counters and count all the tweets again, needed
+        after changing the hashtags of the metadata file
+        :param workers: number of processes used to count the hashtags of tweets without entities
+        """
+        if not rebuild and self.__dbm.get_resume_token(self.COUNTERS_IN_PROGRESS_TOKEN) is not None:
+            # the increments of an interrupted update may have been partially written
+            logging.warning('The last update of the counters of hashtags was interrupted, rebuilding them')
+            rebuild = True
+        if rebuild:
+            self.__dbm_hashtags.clear_collection()
+            self.__dbm_cooccurrences.clear_collection()
+            self.__dbm.clear_resume_token(self.COUNTERS_TOKEN)
+            self.__dbm.clear_resume_token(self.COUNTERS_IN_PROGRESS_TOKEN)
+        last_id = self.__dbm.get_resume_token(self.COUNTERS_TOKEN)
+        if last_id is not None:
+            num_counted = self.__dbm.get_resume_token(self.COUNTERS_TOKEN, 'num_relevant')
+            num_relevant = self.__count_relevant_tweets_until(last_id)
+            if num_counted != num_relevant:
+                logging.warning('The relevance of tweets already counted changed ({0} relevant tweets were counted, '
+                                'now there are {1}), rebuilding the counters of hashtags'.format(num_counted,
+                                                                                                 num_relevant))
+                self.update_hashtag_counters(rebuild=True, workers=workers)
+                return
+        pending_query = {'relevante': {'$exists': 0}, 'tweet_obj.retweeted_status': {'$exists': 0}}
+        pending_tweet = list(self.__dbm.search(pending_query, only_relevant_tws=False).sort('_id', 1).limit(1))
+        upper_query = {'_id': {'$lt': pending_tweet[0]['_id']}} if pending_tweet else {}
+        last_tweet = list(self.__dbm.search(upper_query, only_relevant_tws=False).sort('_id', -1).limit(1))
+        if not last_tweet or (last_id is not None and last_id >= last_tweet[0]['_id']):
+            logging.info('The counters of hashtags are up to date')
+            return
+        id_range = {'$lte': last_tweet[0]['_id']}
+        if last_id is not None:
+            id_range['$gt'] = last_id
+        match = {'relevante': 1, '_id': id_range}
+        # taken before counting, so flags changed meanwhile force a rebuild in the next update
+        num_relevant = self.__count_relevant_tweets_until(last_tweet[0]['_id'])
+        logging.info('Updating the counters of hashtags with the tweets in the range {0}'.format(id_range))
+        hashtags_count, cooccurrences_count = self.__count_hashtags(match, workers)
+        self.__dbm.save_resume_token(self.COUNTERS_IN_PROGRESS_TOKEN, last_tweet[0]['_id'], first_id=last_id,
+                                     num_relevant=num_relevant)
+        self.__dbm_hashtags.bulk_write([UpdateOne({'_id': hashtag}, {'$inc': {'count': count}}, upsert=True)
+                                        for hashtag, count in hashtags_count.items()])
+        self.__dbm_cooccurrences.bulk_write([UpdateOne({'_id': cooccurrence}, {'$inc': {'count': count}},
+                                                       upsert=True)
+                                             for cooccurrence, count in cooccurrences_count.items()])
+        self.__dbm.save_resume_token(self.COUNTERS_TOKEN, last_tweet[0]['_id'], num_relevant=num_relevant)
+        self.__dbm.clear_resume_token(self.COUNTERS_IN_PROGRESS_TOKEN)
+        logging.info('Counted {0} hashtags and {1} combinations of hashtags'.format(len(hashtags_count),
+                                                                                    len(cooccurrences_count)))
+
+    def __get_counts(self, query, counters_db, workers, cooccurrences):
+        if query:
+            # counters are maintained for the whole collection,
+            # subsets of tweets have to be counted on demand
+            match = dict(query)
+            match.update({'relevante': 1})
+            counts = self.__count_hashtags(match, workers)
+            return counts[1] if cooccurrences else counts[0]
+        self.update_hashtag_counters(workers=workers)
+        return {doc['_id']: doc['count'] for doc in counters_db.find_all()}
+
+    def discover_new_hashtags(self, query={}, sorted_results=True, workers=1):
+        hashtags_count = self.__get_counts(query, self.__dbm_hashtags, workers, cooccurrences=False)
+        new_hashtags = {hashtag: count for hashtag, count in hashtags_count.items()
+                        if hashtag.lower() not in self.hashtags}
         if sorted_results:
             return [(k, new_hashtags[k]) for k in sorted(new_hashtags, key=new_hashtags.get, reverse=True)]
         else:
             return new_hashtags
 
+    def build_cooccurrence_matrix(self, query={}, by_party=False):
+        """
+        Build the co-occurrence matrix of all the hashtags of the relevant tweets in a single
+        pass over the collection
+
+        :param query: dictionary with an additional filter of the tweets
+        :param by_party: also build a matrix per political party (flag partido_politico)
+        :return: HashtagCooccurrenceMatrix
+        """
+        match = dict(query)
+        match.update({'relevante': 1})
+        projection = {'tweet_obj.entities.hashtags': 1, 'tweet_obj.retweeted_status.entities.hashtags': 1,
+                      'tweet_obj.text': 1, 'tweet_obj.full_text': 1, 'tweet_obj.retweeted_status.id_str': 1,
+                      'flag.partido_politico': 1}
+        cooccurrence_matrix = HashtagCooccurrenceMatrix()
+        num_tweets = 0
+        for tweet_regs in self.__dbm.iterate_by_id(match, self.BATCH_SIZE, projection):
+            for tweet_reg in tweet_regs:
+                tweet = tweet_reg['tweet_obj']
+                original_tweet = tweet['retweeted_status'] if 'retweeted_status' in tweet.keys() else tweet
+                if 'entities' in original_tweet.keys():
+                    hashtags = ['#' + hashtag['text'] for hashtag in original_tweet['entities']['hashtags']]
+                    hashtags = [hashtag for hashtag in hashtags if u'\u2026' not in hashtag]
+                else:
+                    tweet_text = tweet['full_text'] if 'full_text' in tweet.keys() else tweet['text']
+                    hashtags = [token for token, _ in self.matcher.get_hashtag_tokens(tweet_text)]
+                parties = ()
+                if by_party and 'flag' in tweet_reg.keys():
+                    parties = tuple(party for party, flag in tweet_reg['flag'].get('partido_politico', {}).items()
+                                    if party != '' and flag > 0)
+                cooccurrence_matrix.add_tweet(hashtags, parties)
+            num_tweets += len(tweet_regs)
+            logging.info('Processed {0} tweets, found {1} hashtags'.format(num_tweets,
+                                                                           len(cooccurrence_matrix.hashtags)))
+        return cooccurrence_matrix
+
     def discover_coccurrence_hashtags_by_text(self, tweet_text):
-        known_hashtags = set()
-        for token in tweet_text.split():
-            if u'\u2026' in token:
-                continue
-            if '#' in token:
-                if token.lower() in self.hashtags:
-                    known_hashtags.add(token)
+        known_hashtags = {token for token, is_known in self.matcher.get_hashtag_tokens(tweet_text) if is_known}
         if len(known_hashtags) > 0:
-            return ' '.join(known_hashtags)
+            return ' '.join(sorted(known_hashtags))
         else:
             return None
 
@@ -315,30 +506,12 @@ class HashtagDiscoverer:
             if tweet_hashtag_txt in self.hashtags:
                 known_hashtags.add('#' + tweet_hashtag['text'])
         if len(known_hashtags) > 0:
-            return ' '.join(known_hashtags)
+            return ' '.join(sorted(known_hashtags))
         else:
             return None
 
-    def coccurence_hashtags(self, query={}, sorted_results=True):
-        coccurence_hashtags_dict = defaultdict(int)
-        tweet_regs = self.__dbm.search(query)
-        for tweet_reg in tweet_regs:
-            tweet = tweet_reg['tweet_obj']
-            if 'retweeted_status' in tweet.keys():
-                original_tweet = tweet['retweeted_status']
-            else:
-                original_tweet = tweet
-            if 'entities' in original_tweet.keys():
-                t_hashtags = original_tweet['entities']['hashtags']
-                coccurrence_hashtag_str = self.discover_coccurrence_hashtags_by_entities(t_hashtags)
-            else:
-                if 'full_text' in original_tweet.keys():
-                    tweet_text = tweet['full_text']
-                else:
-                    tweet_text = tweet['text']
-                coccurrence_hashtag_str = self.discover_coccurrence_hashtags_by_text(tweet_text)
-            if coccurrence_hashtag_str:
-                coccurence_hashtags_dict[coccurrence_hashtag_str] += 1
+    def coccurence_hashtags(self, query={}, sorted_results=True, workers=1):
+        coccurence_hashtags_dict = self.__get_counts(query, self.__dbm_cooccurrences, workers, cooccurrences=True)
         if sorted_results:
             return [(k, coccurence_hashtags_dict[k])
                     for k in sorted(coccurence_hashtags_dict, key=coccurence_hashtags_dict.get, reverse=True)]
@@ -346,26 +519,170 @@ class HashtagDiscoverer:
             return coccurence_hashtags_dict
 
 
-def compute_tweets_local_date(force_computation=False, include_hour=False):
+class HashtagCooccurrenceMatrix:
+    """
+    Sparse hashtag x hashtag co-occurrence matrix. Hashtags are lowercased and interned into
+    integer ids, the pairs of every tweet are buffered as coordinates and periodically summed
+    into a CSR matrix, so memory is bounded by the number of distinct pairs plus the buffer.
+    Only the upper triangle is stored, the diagonal holds the number of tweets per hashtag.
+    Matrices can also be kept per political party (slices) in the same pass
+    """
+    BUFFER_SIZE = 1000000
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.hashtags = []
+        self.__slices = {}
+
+    def __get_slice(self, party):
+        if party not in self.__slices:
+            self.__slices[party] = {'rows': array('i'), 'cols': array('i'), 'num_tweets': 0,
+                                    'matrix': sparse.csr_matrix((0, 0), dtype=np.int64)}
+        return self.__slices[party]
+
+    def __compact(self, cooccurrence_slice):
+        num_hashtags = len(self.hashtags)
+        matrix = cooccurrence_slice['matrix']
+        if matrix.shape[0] < num_hashtags:
+            # grow the matrix to the current size of the vocabulary
+            indptr = np.concatenate([matrix.indptr, np.full(num_hashtags - matrix.shape[0], matrix.indptr[-1],
+                                                            dtype=matrix.indptr.dtype)])
+            matrix = sparse.csr_matrix((matrix.data, matrix.indices, indptr), shape=(num_hashtags, num_hashtags))
+        if len(cooccurrence_slice['rows']) > 0:
+            rows = np.frombuffer(cooccurrence_slice['rows'], dtype=np.int32)
+            cols = np.frombuffer(cooccurrence_slice['cols'], dtype=np.int32)
+            buffered = sparse.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                                         shape=(num_hashtags, num_hashtags)).tocsr()
+            matrix = matrix + buffered
+            cooccurrence_slice['rows'], cooccurrence_slice['cols'] = array('i'), array('i')
+        cooccurrence_slice['matrix'] = matrix
+
+    def add_tweet(self, hashtags, parties=()):
+        """
+        :param hashtags: iterable of hashtags (including #) of a tweet
+        :param parties: parties of the tweet, its pairs are also added to their slices
+        """
+        ids = set()
+        for hashtag in hashtags:
+            hashtag = hashtag.lower()
+            if hashtag not in self.vocabulary:
+                self.vocabulary[hashtag] = len(self.hashtags)
+                self.hashtags.append(hashtag)
+            ids.add(self.vocabulary[hashtag])
+        if not ids:
+            return
+        ids = sorted(ids)
+        rows, cols = [], []
+        for i, id_a in enumerate(ids):
+            rows.extend([id_a] * (len(ids) - i))
+            cols.extend(ids[i:])
+        for party in (None,) + tuple(parties):
+            cooccurrence_slice = self.__get_slice(party)
+            cooccurrence_slice['num_tweets'] += 1
+            cooccurrence_slice['rows'].extend(rows)
+            cooccurrence_slice['cols'].extend(cols)
+            if len(cooccurrence_slice['rows']) >= self.BUFFER_SIZE:
+                self.__compact(cooccurrence_slice)
+
+    def get_parties(self):
+        return [party for party in self.__slices.keys() if party is not None]
+
+    def get_matrix(self, party=None):
+        """
+        :return: upper triangular CSR matrix with the number of tweets in which each pair of hashtags
+        (ids of self.vocabulary) appears, the diagonal has the number of tweets of each hashtag
+        """
+        if party not in self.__slices:
+            num_hashtags = len(self.hashtags)
+            return sparse.csr_matrix((num_hashtags, num_hashtags), dtype=np.int64)
+        cooccurrence_slice = self.__slices[party]
+        self.__compact(cooccurrence_slice)
+        return cooccurrence_slice['matrix']
+
+    def __get_pairs(self, party, min_count):
+        pairs = sparse.triu(self.get_matrix(party), k=1).tocoo()
+        selected = pairs.data >= min_count
+        return pairs.row[selected], pairs.col[selected], pairs.data[selected]
+
+    def __to_list(self, rows, cols, counts, scores, top):
+        if top < len(scores):
+            top_idx = np.argpartition(-scores, top)[:top]
+        else:
+            top_idx = np.arange(len(scores))
+        top_idx = top_idx[np.argsort(-scores[top_idx], kind='mergesort')]
+        return [(self.hashtags[rows[i]], self.hashtags[cols[i]], int(counts[i]), float(scores[i]))
+                for i in top_idx]
+
+    def get_top_pairs(self, top=20, party=None):
+        """
+        :return: list of tuples (hashtag_a, hashtag_b, count) of the pairs of hashtags
+        that appear together in more tweets
+        """
+        rows, cols, counts = self.__get_pairs(party, 1)
+        return [pair[:3] for pair in self.__to_list(rows, cols, counts, counts.astype(np.float64), top)]
+
+    def get_association_ranking(self, top=20, party=None, measure='pmi', min_count=5):
+        """
+        Rank the pairs of hashtags by pointwise mutual information, log(p(a,b) / (p(a) p(b))),
+        or by lift, p(a,b) / (p(a) p(b)), where probabilities are estimated over the tweets
+        that have hashtags
+
+        :param measure: 'pmi' or 'lift'
+        :param min_count: pairs that appear together in fewer tweets are discarded because
+        their association scores are unreliable
+        :return: list of tuples (hashtag_a, hashtag_b, count, score)
+        """
+        if measure not in ('pmi', 'lift'):
+            raise Exception('Unknown association measure {0}'.format(measure))
+        matrix = self.get_matrix(party)
+        num_tweets = self.__slices[party]['num_tweets'] if party in self.__slices else 0
+        rows, cols, counts = self.__get_pairs(party, min_count)
+        hashtag_counts = matrix.diagonal().astype(np.float64)
+        lift = counts * num_tweets / (hashtag_counts[rows] * hashtag_counts[cols])
+        scores = np.log(lift) if measure == 'pmi' else lift
+        return self.__to_list(rows, cols, counts, scores, top)
+
+
+# Discoverer of the worker processes that count the hashtags of tweets without entities
+_hashtag_discoverer = None
+
+
+def _init_hashtag_worker():
+    global _hashtag_discoverer
+    _hashtag_discoverer = HashtagDiscoverer()
+
+
+def _count_hashtags_by_text_in_range(task):
+    match, lower_id, upper_id = task
+    return _hashtag_discoverer.count_hashtags_by_text_in_range(match, lower_id, upper_id)
+
+
+def compute_tweets_local_date(force_computation=False, include_hour=False, batch_size=5000):
     dbm = DBManager('tweets')
+    # each query has its own resume token, so an interrupted run
+    # is only resumed by a later run with the same query
     if force_computation:
         query = {}
+        resume_name = 'compute_tweets_local_date_forced'
     else:
         query = {
             'tweet_py_datetime': {'$exists': 0}
         }
-    s_objs = dbm.search(query, only_relevant_tws=False)
-    for s_obj in s_objs:
-        tweet = s_obj['tweet_obj']
-        py_pub_dt = get_py_date(tweet)
-        dict_to_update = {
-            'tweet_py_datetime': datetime.strftime(py_pub_dt, '%m/%d/%y %H:%M:%S'),
-            'tweet_py_date': datetime.strftime(py_pub_dt, '%m/%d/%y')
-        }
-        if include_hour:
-            dict_to_update.update({'tweet_py_hour': datetime.strftime(py_pub_dt, '%H')})
-        dbm.update_record({'tweet_obj.id_str': tweet['id_str']},
-                          dict_to_update)
+        resume_name = 'compute_tweets_local_date'
+    projection = {'tweet_obj.created_at': 1}
+    for s_objs in dbm.iterate_by_id(query, batch_size, projection, resume_name=resume_name):
+        py_pub_dts = get_py_dates([s_obj['tweet_obj']['created_at'] for s_obj in s_objs])
+        updates = []
+        for s_obj, py_pub_dt in zip(s_objs, py_pub_dts):
+            dict_to_update = {
+                'tweet_py_datetime': datetime.strftime(py_pub_dt, '%m/%d/%y %H:%M:%S'),
+                'tweet_py_date': datetime.strftime(py_pub_dt, '%m/%d/%y')
+            }
+            if include_hour:
+                dict_to_update.update({'tweet_py_hour': datetime.strftime(py_pub_dt, '%H')})
+            updates.append(UpdateOne({'_id': s_obj['_id']}, {'$set': dict_to_update}))
+        dbm.bulk_write(updates)
+        logging.info('Computed the local date of {0} tweets'.format(len(updates)))
     return
 
 
@@ -396,78 +713,218 @@ def save_original_tweets_file():
             writer.writerow(tweet_dict)
 
 
+class VideoProber:
+    """
+    Check whether tweets have videos by querying the video config endpoint of the Twitter API
+    with a user authorization bearer, a response 200 means that the tweet has a video.
+    Requests are issued concurrently from an asyncio loop over a pool of persistent
+    connections (the blocking HTTP calls run in threads), the pace is set by the headers
+    x-rate-limit-remaining and x-rate-limit-reset, and results are written in bulk
+    """
+    method = 'video_config_api'
+    api_path = '/1.1/videos/tweet/config/{0}.json'
+    # failed requests are retried with exponential backoff up to MAX_RETRIES times
+    MAX_RETRIES = 5
+    BACKOFF_SECONDS = 1
+    # wait after a 429 whose reset time is missing or already passed
+    MIN_RATE_LIMIT_WAIT = 60
+
+    def __init__(self, user_bearer, concurrency=10, flush_size=100, host='api.twitter.com', port=None,
+                 use_https=True):
+        self.user_bearer = user_bearer
+        self.concurrency = concurrency
+        self.flush_size = flush_size
+        self.host, self.port, self.use_https = host, port, use_https
+        self.__rate_limit_remaining = None
+        self.__rate_limit_reset = None
+        self.__rate_limit_lock = None
+        self.__connections = None
+        self.__executor = None
+        self.__pending_updates = []
+        self.__dbm = DBManager('tweets')
+
+    def __new_connection(self):
+        if self.use_https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=30)
+        else:
+            return http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def __request_video_config(self, conn, id_tweet):
+        headers = {'authorization': 'Bearer ' + self.user_bearer}
+        conn.request('GET', self.api_path.format(id_tweet), None, headers)
+        response = conn.getresponse()
+        # the body has to be read to reuse the connection
+        body = response.read()
+        return response.status, response.headers, body
+
+    async def __wait_rate_limit(self):
+        async with self.__rate_limit_lock:
+            if self.__rate_limit_remaining is not None and self.__rate_limit_remaining <= 0:
+                seconds_until_expiration = self.__rate_limit_reset - calendar.timegm(time.gmtime())
+                if seconds_until_expiration > 0:
+                    logging.info('Twitter API rate limit exceeded. Waiting for {0} seconds'
+                                 .format(seconds_until_expiration + 1))
+                    await asyncio.sleep(seconds_until_expiration + 1)
+                self.__rate_limit_remaining = None
+            elif self.__rate_limit_remaining is not None:
+                # reserve a request of the current window
+                self.__rate_limit_remaining -= 1
+
+    def __update_rate_limit(self, status, headers):
+        if 'x-rate-limit-remaining' in headers and 'x-rate-limit-reset' in headers:
+            self.__rate_limit_remaining = int(headers['x-rate-limit-remaining'])
+            self.__rate_limit_reset = int(headers['x-rate-limit-reset'])
+        if status == 429:
+            self.__rate_limit_remaining = 0
+            now = calendar.timegm(time.gmtime())
+            if self.__rate_limit_reset is None or self.__rate_limit_reset <= now:
+                self.__rate_limit_reset = now + self.MIN_RATE_LIMIT_WAIT
+
+    async def __probe_tweet(self, id_tweet):
+        """
+        :return: tuple with the status, headers and body of the response, or None if
+        the tweet couldn't be probed after MAX_RETRIES retries
+        """
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.MAX_RETRIES + 1):
+            await self.__wait_rate_limit()
+            conn = await self.__connections.get()
+            try:
+                status, headers, body = await loop.run_in_executor(self.__executor, self.__request_video_config,
+                                                                   conn, id_tweet)
+            except (http.client.HTTPException, OSError) as e:
+                logging.info('Error when probing the tweet {0}: {1}'.format(id_tweet, e))
+                conn.close()
+                conn = self.__new_connection()
+                if attempt < self.MAX_RETRIES:
+                    await asyncio.sleep(self.BACKOFF_SECONDS * 2 ** attempt)
+                continue
+            finally:
+                self.__connections.put_nowait(conn)
+            self.__update_rate_limit(status, headers)
+            if status != 429:
+                return status, headers, body
+        logging.error('Could not probe the tweet {0} after {1} retries'.format(id_tweet, self.MAX_RETRIES))
+        return None
+
+    async def __flush(self):
+        updates, self.__pending_updates = self.__pending_updates, []
+        if updates:
+            await asyncio.get_event_loop().run_in_executor(self.__executor, self.__dbm.bulk_write, updates)
+
+    async def __worker(self, tweets_queue, results):
+        while True:
+            try:
+                tweet_reg = tweets_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            id_tweet = tweet_reg['tweet_obj']['id_str']
+            response = await self.__probe_tweet(id_tweet)
+            if response is None:
+                # failed tweets don't get the key of the method, so they are probed again in the next run
+                results['failed'] += 1
+                self.__pending_updates.append(UpdateOne({'_id': tweet_reg['_id']},
+                                                        {'$set': {self.method + '_failed': 1}}))
+                continue
+            status, headers, body = response
+            is_video = 1 if status == http.client.OK else 0
+            logging.info('The tweet {0} {1} a video! Response STATUS = {2}'.format(id_tweet,
+                                                                                  'HAS' if is_video else 'DOES NOT have',
+                                                                                  status))
+            results[is_video] += 1
+            self.__pending_updates.append(UpdateOne({'_id': tweet_reg['_id']},
+                                                    {'$set': {self.method: {'is_video': is_video,
+                                                                            'is_video_response': str(body)}},
+                                                     '$unset': {self.method + '_failed': ''}}))
+            if len(self.__pending_updates) >= self.flush_size:
+                await self.__flush()
+
+    async def __probe_tweets(self, tweet_regs):
+        self.__rate_limit_lock = asyncio.Lock()
+        self.__connections = asyncio.Queue()
+        for _ in range(self.concurrency):
+            self.__connections.put_nowait(self.__new_connection())
+        tweets_queue = asyncio.Queue()
+        for tweet_reg in tweet_regs:
+            tweets_queue.put_nowait(tweet_reg)
+        results = defaultdict(int)
+        try:
+            await asyncio.gather(*[self.__worker(tweets_queue, results) for _ in range(self.concurrency)])
+        finally:
+            await self.__flush()
+            while not self.__connections.empty():
+                self.__connections.get_nowait().close()
+        return results
+
+    def probe_tweets(self, tweet_regs):
+        """
+        Probe the tweets that haven't been probed yet (i.e., that don't have the key
+        video_config_api), so an interrupted run can be resumed by calling it again
+
+        :param tweet_regs: list of tweet records
+        :return: dictionary with the number of tweets without (0) and with (1) videos, and
+        the number of tweets that couldn't be probed (failed)
+        """
+        tweet_regs = [tweet_reg for tweet_reg in tweet_regs if self.method not in tweet_reg.keys()]
+        logging.info('Probing {0} tweets with {1} concurrent requests'.format(len(tweet_regs), self.concurrency))
+        loop = asyncio.new_event_loop()
+        self.__executor = ThreadPoolExecutor(self.concurrency + 1)
+        try:
+            return loop.run_until_complete(self.__probe_tweets(tweet_regs))
+        finally:
+            self.__executor.shutdown()
+            loop.close()
+
+
 # Two methods to add video property:
 # 1. Query https://twitter.com/i/videos/STATUS_ID
 #    If there is embedded video in resulting HTML, then tweet is video
 # 2. Use an authenticated user authorization bearer and query https://api.twitter.com//1.1/videos/tweet/config/STATUS_ID .json
 #    If response is 200, there is a video
 #
-# (1) might be faster with a good connection, but (2) is more accurate
-# even though users are limited to 300 requests per every 15 minutes window
-def add_video_property(use_video_config_api = False, user_bearer=None):
+# (1) requires a browser and waits some seconds per tweet while (2) is more accurate and runs
+# concurrently (see VideoProber) even though users are limited to 300 requests per every 15 minutes window
+def add_video_property(use_video_config_api = False, user_bearer=None, concurrency=10):
     db = DBManager('tweets')
     plain_tweets = db.get_plain_tweets()
     tot_plain_tweets = len(plain_tweets)
     logging.info('Plain tweets {0}'.format(tot_plain_tweets))
-    tweet_counter = 0
 
-    if not use_video_config_api:
-        driver = webdriver.Chrome()
+    if use_video_config_api:
+        prober = VideoProber(user_bearer, concurrency)
+        return prober.probe_tweets(plain_tweets)
 
+    from selenium import webdriver
+    driver = webdriver.Chrome()
+    tweet_counter = 0
+    method = "video_embed_url"
     for plain_tweet in plain_tweets:
         tweet_counter += 1
-        response = None
-        if 'video_config_api' in plain_tweet.keys():
+        # tweets already resolved by the video config API or by a previous run are not probed again
+        if method in plain_tweet.keys() or VideoProber.method in plain_tweet.keys():
              continue
         logging.info('Remaining tweets: {0}'.format(tot_plain_tweets - tweet_counter))
         id_tweet = plain_tweet['tweet_obj']['id_str']
         found_message = False
-        method = "video_config_api"
-        result_value = None
-        result_status = None
-        result_headers = None
-        if not use_video_config_api:
-            method = "video_embed_url"
-            video_url = 'https://twitter.com/i/videos/'
-            url = video_url + id_tweet
-            driver.get(url)
-            time.sleep(5)
-            spans = driver.find_elements_by_tag_name('span')
-            span_texts = [span.text for span in spans]
-            result_value = str(span_texts)
-            for span_text in span_texts:
-                if span_text == 'The media could not be played.':
-                    found_message = True
-                    break
-        else:
-            import http.client
-            response = get_video_config_with_user_bearer(user_bearer, id_tweet)
-            curr_rate_limit_remaining = int(response.headers['x-rate-limit-remaining'])
-            curr_time = calendar.timegm(time.gmtime())
-            curr_rate_limit_expiration = int(response.headers['x-rate-limit-reset'])
-            seconds_until_expiration = curr_rate_limit_expiration - curr_time
-
-            result_value = str(response.read())
-            result_headers = str(response.headers)
-            result_status = str(response.status)
-
-            if response.status != http.client.OK:
-                found_message=True
-
-            if curr_rate_limit_remaining == 0:
-                logging.info('\n\nProcessed {0} tweets Twitter API rate limit exceeded. Waiting for {1} seconds'
-                             .format(tweet_counter, seconds_until_expiration+1))
-                time.sleep(seconds_until_expiration+1)
+        video_url = 'https://twitter.com/i/videos/'
+        url = video_url + id_tweet
+        driver.get(url)
+        time.sleep(5)
+        spans = driver.find_elements_by_tag_name('span')
+        span_texts = [span.text for span in spans]
+        result_value = str(span_texts)
+        for span_text in span_texts:
+            if span_text == 'The media could not be played.':
+                found_message = True
+                break
 
         update_object = {}
         if found_message:
-            logging.info('\n\nThe tweet {0} DOES NOT have a video! Response STATUS = \n{1}, HEADERS = \n{2}, \nBODY = {3} \n'
-                             .format(id_tweet, result_status, result_headers, result_value))
+            logging.info('\n\nThe tweet {0} DOES NOT have a video! \nBODY = {1} \n'.format(id_tweet, result_value))
             update_object[method] = {'is_video': 0, 'is_video_response': result_value}
             db.update_record({'tweet_obj.id_str': id_tweet}, update_object)
         else:
-            logging.info('\n\nThe tweet {0} HAS a video! Response STATUS = {1}, HEADERS = {2} \n'
-                         .format(id_tweet, result_status,  result_headers))
+            logging.info('\n\nThe tweet {0} HAS a video! \n'.format(id_tweet))
             update_object[method] = {'is_video': 1, 'is_video_response': result_value}
             db.update_record({'tweet_obj.id_str': id_tweet}, update_object)
 
@@ -1,10 +1,11 @@
 from collections import defaultdict
 from datetime import datetime
 from pymongo import MongoClient
-from src.utils.utils import get_config, get_user_handlers_and_hashtags, get_py_date
+from src.utils.utils import get_config, get_user_handlers_and_hashtags, get_py_date, DomainNormalizer
 
 import pathlib
 import logging
+import re
 
 
 logging.basicConfig(filename=str(pathlib.Path(__file__).parents[1].joinpath('politic_bots.log')), level=logging.DEBUG)
@@ -65,6 +66,116 @@ class DBManager:
     def remove_record(self, query):
         self.__db[self.__collection].delete_one(query)
 
+    def get_resume_token(self, resume_name, field='last_id'):
+        token = self.__db['resume_tokens'].find_one({'_id': self.__collection + '.' + resume_name})
+        return token.get(field) if token else None
+
+    def save_resume_token(self, resume_name, last_id, **fields):
+        # extra fields describe the state in which the token was saved
+        fields.update({'last_id': last_id, 'updated_at': datetime.now()})
+        self.__db['resume_tokens'].update_one({'_id': self.__collection + '.' + resume_name},
+                                              {'$set': fields}, upsert=True)
+
+    def clear_resume_token(self, resume_name):
+        self.__db['resume_tokens'].delete_one({'_id': self.__collection + '.' + resume_name})
+
+    def iterate_by_id(self, query, batch_size=1000, projection=None, resume_name=None, lower_id=None,
+                      upper_id=None, save_resume=True):
+        """
+        Iterate over the records that match the query in batches sorted by _id. Each batch
+        is fetched with a range condition on _id that starts after the last record of the
+        previous batch (keyset pagination), so the collection is never rescanned from the
+        beginning, even if processing a batch makes its records stop matching the query
+
+        :param query: dictionary with the filter of the records, it is used as is
+        :param batch_size: number of records per batch
+        :param projection: fields of the records to return, all if None
+        :param resume_name: name of the resume token. If given, the _id of the last record of
+        every processed batch is persisted in the collection resume_tokens, an interrupted
+        iteration continues from there, and the token is removed when the iteration ends
+        :param lower_id: if given, only records with _id >= lower_id are iterated
+        :param upper_id: if given, only records with _id < upper_id are iterated
+        :param save_resume: if False, the resume token is only read, the caller saves it (and clears
+        it) once the records are done, e.g., when batches are read ahead of their processing
+        :return: generator of lists of records
+        """
+        last_id = None
+        if resume_name:
+            last_id = self.get_resume_token(resume_name)
+            if last_id is not None:
+                logging.info('Resuming the iteration {0} after the record {1}'.format(resume_name, last_id))
+        id_range = {}
+        if lower_id is not None:
+            id_range['$gte'] = lower_id
+        if upper_id is not None:
+            id_range['$lt'] = upper_id
+        while True:
+            conditions = [query]
+            if id_range:
+                conditions.append({'_id': id_range})
+            if last_id is not None:
+                conditions.append({'_id': {'$gt': last_id}})
+            batch_query = {'$and': conditions} if len(conditions) > 1 else query
+            cursor = self.__db[self.__collection].find(batch_query, projection)
+            batch = list(cursor.sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            # the caller processes the batch before asking for the next one,
+            # so from here on the batch can be considered done
+            yield batch
+            last_id = batch[-1]['_id']
+            if resume_name and save_resume:
+                self.save_resume_token(resume_name, last_id)
+            if len(batch) < batch_size:
+                break
+        if resume_name and save_resume:
+            self.clear_resume_token(resume_name)
+
+    def get_id_ranges(self, query, num_ranges):
+        """
+        Split the records that match the query into ranges of _id of about the same size
+
+        :param query: dictionary with the filter of the records
+        :param num_ranges: maximum number of ranges
+        :return: list of tuples (lower_id, upper_id) to be used as bounds of iterate_by_id,
+        the first lower bound and the last upper bound are None (unbounded)
+        """
+        pipeline = [
+            {'$match': query},
+            {'$bucketAuto': {'groupBy': '$_id', 'buckets': num_ranges}}
+        ]
+        buckets = self.aggregate(pipeline)
+        if not buckets:
+            return []
+        boundaries = [bucket['_id']['min'] for bucket in buckets[1:]]
+        lower_ids = [None] + boundaries
+        upper_ids = boundaries + [None]
+        return list(zip(lower_ids, upper_ids))
+
+    def rename_collection(self, new_name):
+        """
+        Rename the collection, replacing the collection new_name if it exists. The
+        replacement is atomic, readers see either the old or the new collection
+
+        :param new_name: new name of the collection
+        """
+        self.__db[self.__collection].rename(new_name, dropTarget=True)
+        self.__collection = new_name
+
+    def create_index(self, keys, **kwargs):
+        """
+        Create an index on the collection if it does not exist yet
+
+        :param keys: name of a field or list of tuples (field, direction)
+        :return: name of the index
+        """
+        return self.__db[self.__collection].create_index(keys, **kwargs)
+
+    def bulk_write(self, operations, ordered=False):
+        if operations:
+            return self.__db[self.__collection].bulk_write(operations, ordered=ordered)
+        return None
+
     def find_tweets_by_author(self, author_screen_name, **kwargs):
         query = {'tweet_obj.user.screen_name': author_screen_name, 'relevante': 1}
         if 'limited_to_time_window' in kwargs.keys():
@@ -270,7 +381,13 @@ class DBManager:
                 '$sort': {'count': -1}
             }
         ]
-        return self.aggregate(pipeline)
+        # domains saved with an abbreviation (e.g., fb) are counted under their full name
+        domain_normalizer = DomainNormalizer()
+        domains = defaultdict(int)
+        for result_doc in self.aggregate(pipeline):
+            domains[domain_normalizer.normalize_domain(result_doc['domain'])] += result_doc['count']
+        return [{'domain': domain, 'count': count}
+                for domain, count in sorted(domains.items(), key=lambda k_v: k_v[1], reverse=True)]
 
     def get_tweets_with_photo(self, **kwargs):
         match = {
@@ -410,6 +527,50 @@ class DBManager:
                 keywords.remove(keyword)
         return keywords
 
+    def __get_tweet_hashtags_stages(self, match):
+        # hashtags of the tweet, or of the original tweet in case of retweets,
+        # with their original case and lowercased to compare them with the keywords
+        return [
+            {'$match': match},
+            {'$project': {'hashtags': {'$cond': [{'$gt': ['$tweet_obj.retweeted_status', None]},
+                                                 '$tweet_obj.retweeted_status.entities.hashtags',
+                                                 '$tweet_obj.entities.hashtags']}}},
+            {'$unwind': '$hashtags'},
+            {'$project': {'hashtag': {'$concat': ['#', '$hashtags.text']},
+                          'hashtag_lower': {'$concat': ['#', {'$toLower': '$hashtags.text'}]}}},
+            {'$match': {'hashtag': {'$not': re.compile(u'\u2026')}}}
+        ]
+
+    def get_hashtags_count(self, match):
+        """
+        Count the number of tweets in which each hashtag appears
+
+        :param match: filter of the tweets, it should only select tweets with entities
+        :return: list of dictionaries {'_id': hashtag, 'count': number of tweets}
+        """
+        pipeline = self.__get_tweet_hashtags_stages(match) + [
+            {'$group': {'_id': {'tweet': '$_id', 'hashtag': '$hashtag'}}},
+            {'$group': {'_id': '$_id.hashtag', 'count': {'$sum': 1}}}
+        ]
+        return self.aggregate(pipeline)
+
+    def get_hashtags_cooccurrence(self, match, hashtags):
+        """
+        Count the number of tweets in which each combination of the given hashtags appears
+
+        :param match: filter of the tweets, it should only select tweets with entities
+        :param hashtags: list of lowercased hashtags (including #) to consider
+        :return: list of dictionaries {'_id': sorted list of hashtags, 'count': number of tweets}
+        """
+        pipeline = self.__get_tweet_hashtags_stages(match) + [
+            {'$match': {'hashtag_lower': {'$in': hashtags}}},
+            {'$group': {'_id': {'tweet': '$_id', 'hashtag': '$hashtag'}}},
+            {'$sort': {'_id.hashtag': 1}},
+            {'$group': {'_id': '$_id.tweet', 'hashtags': {'$push': '$_id.hashtag'}}},
+            {'$group': {'_id': '$hashtags', 'count': {'$sum': 1}}}
+        ]
+        return self.aggregate(pipeline)
+
     def get_unique_users(self, **kwargs):
         match = {
             'relevante': {'$eq': 1}
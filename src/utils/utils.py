@@ -2,8 +2,11 @@ import csv
 import json
 import pathlib
 import re
+import tldextract
 
 from datetime import datetime, timedelta, tzinfo
+from functools import lru_cache
+from urllib.parse import urlsplit
 
 
 # Get configuration from file
@@ -48,6 +51,98 @@ def get_user_handlers_and_hashtags():
     return user_handlers, hashtags
 
 
+class KeywordMatcher:
+    """
+    Matcher of the user handlers and hashtags listed in the metadata file. The keywords are
+    kept in frozensets and the characters to ignore in a translation table, both built once,
+    so matching a text takes a single scan of it instead of a regex substitution per token
+    """
+    # characters removed from the tokens of a text before comparing them
+    # with the keywords, includes the ellipsis unicode char
+    special_chars = '=+/&<>;:\'"?%$!¡,.\u2026'
+    hashtag_token = re.compile(r'\S*#\S*')
+
+    def __init__(self, user_handlers=None, hashtags=None):
+        if user_handlers is None or hashtags is None:
+            user_handlers, hashtags = get_user_handlers_and_hashtags()
+        self.user_handlers = frozenset(user_handlers)
+        self.hashtags = frozenset(hashtags)
+        self.__special_chars_table = str.maketrans('', '', self.special_chars)
+
+    def count_keywords(self, text):
+        """
+        Count the tokens of the text that are user handlers or hashtags of interest
+
+        :param text: text of the tweet
+        :return: tuple with the number of user handlers and the number of hashtags
+        """
+        users_counter, hashtags_counter = 0, 0
+        for token in text.translate(self.__special_chars_table).lower().split():
+            if token in self.user_handlers:
+                users_counter += 1
+            elif token in self.hashtags:
+                hashtags_counter += 1
+        return users_counter, hashtags_counter
+
+    def get_hashtag_tokens(self, text):
+        """
+        Get the tokens of the text that contain a hashtag, tokens truncated
+        with an ellipsis are discarded
+
+        :param text: text of the tweet
+        :return: list of tuples (token, is_known), is_known indicates whether the
+        token is one of the hashtags of interest
+        """
+        return [(token, token.lower() in self.hashtags) for token in self.hashtag_token.findall(text)
+                if u'\u2026' not in token]
+
+
+class DomainNormalizer:
+    """
+    Extractor of the registrable domain name of urls (e.g., https://m.facebook.com/a -> facebook).
+    The public suffix list is the snapshot bundled with the pinned version of tldextract, so
+    it is never fetched from the network, shortened domains are replaced according to an alias
+    table, and the domain of every host is memoized. Aliases are looked up by the full registered
+    domain (e.g., t.co, so t.me is not taken for twitter) and then by the label of the domain,
+    which only lists unambiguous labels (e.g., amzn, used with several suffixes)
+    """
+    aliases_file = pathlib.Path(__file__).parent.joinpath('domain_aliases.json')
+
+    def __init__(self, aliases=None, memo_size=100000):
+        """
+        :param aliases: dictionary with the aliases of registered domains (registered_domains) and
+        of domain labels (labels), by default loaded from domain_aliases.json
+        :param memo_size: maximum number of hosts whose domain is memoized
+        """
+        if aliases is None:
+            aliases = get_config(self.aliases_file)
+        self.registered_domain_aliases = dict(aliases.get('registered_domains', {}))
+        self.label_aliases = dict(aliases.get('labels', {}))
+        self.__extract = tldextract.TLDExtract(suffix_list_urls=None, cache_file=False)
+        self.get_host_domain = lru_cache(maxsize=memo_size)(self.__get_host_domain)
+
+    def __get_host_domain(self, host):
+        extract_result = self.__extract(host)
+        registered_domain = extract_result.registered_domain
+        if registered_domain in self.registered_domain_aliases:
+            return self.registered_domain_aliases[registered_domain]
+        return self.normalize_domain(extract_result.domain)
+
+    def normalize_domain(self, domain_name):
+        """
+        :param domain_name: registered domain (e.g., youtu.be) or label of a domain (e.g., youtu)
+        :return: canonical name of the domain
+        """
+        if domain_name in self.registered_domain_aliases:
+            return self.registered_domain_aliases[domain_name]
+        return self.label_aliases.get(domain_name, domain_name)
+
+    def get_domain(self, url):
+        # urls without scheme are given to tldextract as they are
+        host = urlsplit(url).hostname if '//' in url else None
+        return self.get_host_domain(host or url)
+
+
 # Paraguayan Timezone
 class UTC4(tzinfo):
     def utcoffset(self, dt):
@@ -77,6 +172,49 @@ def get_py_date(tweet):
     return pub_dt.astimezone(PYT)
 
 
+# Boundaries of the daylight saving time per year, they are
+# computed as in UTC4.dst but only once per year
+_dst_boundaries = {}
+_months = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+           'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+def _get_dst_boundaries(year):
+    if year not in _dst_boundaries:
+        d = datetime(year, 11, 1)
+        dston = d - timedelta(days=d.weekday() + 1)
+        d = datetime(year+1, 4, 1)
+        dstoff = d - timedelta(days=d.weekday() + 1)
+        _dst_boundaries[year] = (dston, dstoff)
+    return _dst_boundaries[year]
+
+
+def get_py_dates(str_pub_dts):
+    """
+    Convert a batch of dates in the format used by Twitter (e.g., Wed Oct 10 20:19:24 +0000 2018)
+    to the paraguayan timezone. Results are the same as those of get_py_date, but the dates are
+    parsed by hand and the daylight saving time boundaries are computed once per year
+
+    :param str_pub_dts: list of dates as strings
+    :return: list of naive datetimes in paraguayan time
+    """
+    py_dts = []
+    for str_pub_dt in str_pub_dts:
+        _, month, day, str_time, offset, year = str_pub_dt.split()
+        hour, minute, second = str_time.split(':')
+        utc_dt = datetime(int(year), _months[month], int(day), int(hour), int(minute), int(second))
+        offset_minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+        if offset_minutes:
+            utc_dt -= timedelta(minutes=offset_minutes if offset[0] == '+' else -offset_minutes)
+        # convert to paraguayan timezone, as tzinfo.fromutc does with UTC4
+        py_dt = utc_dt - timedelta(hours=4)
+        dston, dstoff = _get_dst_boundaries(py_dt.year)
+        if dston <= py_dt < dstoff:
+            py_dt += timedelta(hours=1)
+        py_dts.append(py_dt)
+    return py_dts
+
+
 def clean_emojis(doc):
     emoji_pattern = re.compile("["
         "\U0001F600-\U0001F64F"  # emoticons